@@ -3,16 +3,42 @@ import sys
 import os
 import glob
 import re
+import time
+import json
+import threading
+import hashlib
 import argparse
 import platform
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from jinja2 import Template
 
+import timings
+
+# the render manifest that makes reruns skip the images that are up to date
+MANIFEST = "render_manifest.json"
+# the directory for downsampled and cropped cubes
+PREP_DIR = "slim"
+# seconds between two looks at the images chimera is writing
+POLL_INTERVAL = 0.5
+
 
 def getinput(args):
     """parse the input"""
     parser = argparse.ArgumentParser(
         description=("Find several cube files and convert them to jpeg.")
     )
+    parser.add_argument(
+        "--batch",
+        "-b",
+        nargs="+",
+        metavar="DIR",
+        help=(
+            "render many molecule directories, each with its own session and cubes, "
+            "with one shared pool of chimera workers"
+        ),
+    )
     parser.add_argument(
         "--supersampling",
         "-ss",
@@ -64,6 +90,112 @@ def getinput(args):
     parser.add_argument(
         "-rt", "--raytrace", action="store_true"
     )
+    parser.add_argument(
+        "--workers",
+        "-j",
+        default=1,
+        type=int,
+        help="number of chimera processes rendering in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--backend",
+        default="chimera",
+        choices=["chimera", "python"],
+        help=(
+            "chimera, or python: marching cubes and matplotlib offscreen in parallel "
+            "processes, no chimera or display needed (default: chimera)"
+        ),
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="start chimera with --nogui --offscreen (needs an OSMesa build of chimera)",
+    )
+    parser.add_argument(
+        "--states",
+        "-st",
+        nargs="+",
+        type=int,
+        help=(
+            "render only the CDD, hole, electron and transition density cubes of these "
+            "states (as pyparse.py --states)"
+        ),
+    )
+    parser.add_argument(
+        "--gaussian-log",
+        "-log",
+        help=(
+            "Gaussian output of the states, only the MOs pyparse.py shows for the wanted "
+            "states (weight >= 8%%) are rendered"
+        ),
+    )
+    parser.add_argument(
+        "--auto-isovalue",
+        "-ai",
+        type=float,
+        help=(
+            "pick the isovalue of every cube so that the isosurface encloses this fraction "
+            "of the density (|value|, value**2 for MOs), e.g. 0.8"
+        ),
+    )
+    parser.add_argument(
+        "--downsample",
+        "-ds",
+        default=1,
+        type=int,
+        help="keep only every n-th grid point of the cubes before rendering (default: 1)",
+    )
+    parser.add_argument(
+        "--crop",
+        action="store_true",
+        help="crop the cubes to the region above the isovalue before rendering",
+    )
+    parser.add_argument(
+        "--crop-margin",
+        default=3,
+        type=int,
+        help="grid points kept around the cropped region (default: 3)",
+    )
+    parser.add_argument(
+        "--cube-cache",
+        action="store_true",
+        help="keep binary copies of the cubes in cubecache/ so the text is only parsed once",
+    )
+    parser.add_argument(
+        "--thumbnails",
+        "-th",
+        action="store_true",
+        help=(
+            "write hole, electron and MO thumbnails with the names and widths "
+            "(--cdd-image-width, --mo-image-width) that pyparse.py expects"
+        ),
+    )
+    parser.add_argument(
+        "--thumb-dpi",
+        default=300,
+        type=int,
+        help="DPI of the thumbnails, default 300",
+    )
+    parser.add_argument(
+        "--log",
+        default="render_log.jsonl",
+        help=(
+            "JSON lines log with start, end, cube and image size and status of every image "
+            "(default: render_log.jsonl)"
+        ),
+    )
+    parser.add_argument(
+        "--keep-inputs",
+        action="store_true",
+        help="keep the chimera inputs after rendering, failed ones are always kept",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="render all images, even if they are up to date according to the render manifest",
+    )
+    timings.add_arguments(parser)
+
     return parser.parse_args(args)
 
 
@@ -75,263 +207,750 @@ def WindowSize(data):
                 return re.split("[(),]", line)
 
 
-# find the session file and all relevant cube files
-session = glob.glob("*.py")
-# find Multiwfn's Charge density (CDD='electron'-'hole') files
-cdds = glob.glob("*CDD*.cub")
-orca_cdds = glob.glob("*cisdp*.cube")
-# find Multiwfn's electron-files
-eles = glob.glob("*electron*.cub")
-# find Multiwfn's hole-files
-hols = glob.glob("*hole*.cub")
-# find all MO cube files
-orbs = glob.glob("*orb*.cub")
-# find one file for spindensity
-spindensity = glob.glob("spind*nsity.cub")
-# find transition densities
-transdens = glob.glob("transdens*.cub")
-
-# if more than one or no session file ... actually *.py file ... is found
-# the script aborts
-print(os.getcwd())
-if len(session) > 1:
-    print("More than one chimera session found. Reduce to one!")
-    print(session)
-    sys.exit(0)
-elif len(session) < 1:
-    print("No session file found")
-    sys.exit(0)
-else:
+def find_session():
+    """find the chimera session file ... actually the only *.py file"""
+    session = glob.glob("*.py")
+    # if more than one or no session file ... actually *.py file ... is found
+    # the directory is skipped
+    print(os.getcwd())
+    if len(session) > 1:
+        print("More than one chimera session found. Reduce to one!")
+        print(session)
+        return None
+    elif len(session) < 1:
+        print("No session file found")
+        return None
     session = session[0]
     print("Chimera session file found: " + session)
+    return session
 
-# get the window size to change it later
-WWidth, WHeight = WindowSize(session)[1:3]
-WWidth = int(WWidth)
-WHeight = int(WHeight)
-
-# parse the arguments
-args = getinput(sys.argv[1:])
-
-# define the quality of the resulting images
-# color preset is the publication preset that can be set in chimera
-ColorPreset = "2"
-# cube resolution 1 means 'use every point', 2 would be use every 2nd point
-CubeResolution = "1"
-# super sampling of the final image
-SuperSample = str(args.supersampling)
-# pixel density
-DPI = str(args.dpi)
-# image width for CDD, electron and hole for docx
-CDDimagewidth = args.cdd_image_width # cm
-# image width for MOs for docx
-MOimagewidth = args.mo_image_width # cm
-# image units
-units = args.image_units
-# image type ... could also be png
-FileType = str(args.filetype)
-# background color
-backgroundcolor = str(args.background)
-# the isovalue for the MOs
-orbLevel = "0.04"
-# the isovalue for densities
-cddLevel = "0.002"
-# the RGB colors for MOs
-orbRGB = [["0", ".5", ".6"], [".9", ".7", ".1"]]
-# the RGB colors for 'regular' densities
-cddRGB = [["0", "0.8", "1"], ["1", "0.2", "0"]]
-# the RGB for spin densities
-sdRGB = [["0", "0.2", "0.6"], ["0", "0.6", "0.3"]]
-# the enlargement for the image size ... window size multiplier
-sizeFactor = args.sizefactor
-
-# stephan's colors and a preset to fit GaussView more or less
-if args.stephan:
-    orbRGB = [["0.0", "0.4", "0.0"], ["1.0", "1.0", "0.0"]]
-    cddRGB = [["1.0", "0.0", "0.0"], ["0.0", "0.47451", "1.0"]]
-    ColorPreset = "4"
-
-# abs cubes
-if args.abs_cubes:
-    cddLevel = orbLevel
-
-# template for easy use when creating the output
-# if the image should be rendered with PovRay, activate the raytrace part
-if args.raytrace:
-    template = Template(
-        (
-            "\nopen {{ name }}"
-            "\npreset apply pub {{ preset }}; color byelement"
-            "\nvolume #1 level -{{ level }} color {{ minus }}"
-            " level {{ level }} color {{ plus }} step {{ cubres }}"
-            "\nbackground solid {{ bgcolor }}"
-            "\nsetattr M stickScale 0.6 #; unset depthCue"
-            "\ncopy file {{ output }} supersample {{ supsam }} "
-            "dpi {{ dpi }} width {{ width }} units {{ units }}"
-            'raytrace rtwait'
-            "\nclose #1"
+
+def find_cubes():
+    """find all relevant cube files"""
+    return {
+        # find Multiwfn's Charge density (CDD='electron'-'hole') files
+        "cdd": glob.glob("*CDD*.cub"),
+        "orca_cdd": glob.glob("*cisdp*.cube"),
+        # find Multiwfn's electron-files
+        "electron": glob.glob("*electron*.cub"),
+        # find Multiwfn's hole-files
+        "hole": glob.glob("*hole*.cub"),
+        # find all MO cube files
+        "orb": glob.glob("*orb*.cub"),
+        # find one file for spindensity
+        "spindensity": glob.glob("spind*nsity.cub"),
+        # find transition densities
+        "transdens": glob.glob("transdens*.cub"),
+    }
+
+
+def cube_number(name):
+    """the state or MO number of a cube, the last number in its name"""
+    numbers = re.findall(r"\d+", os.path.basename(name))
+    return int(numbers[-1]) if numbers else None
+
+
+def wanted_cubes(cubes, states, logfile=None):
+    """only the cubes of the wanted states and the MOs of their excitations"""
+    selected = dict(cubes)
+    for kind in ("cdd", "orca_cdd", "electron", "hole", "transdens"):
+        selected[kind] = [cube for cube in cubes[kind] if cube_number(cube) in states]
+    if logfile:
+        import pyparse
+
+        pyargs = argparse.Namespace(parser="pyparse")
+        header = pyparse.read_header(logfile)
+        scale, _ = pyparse.is_closed_shell(header, pyargs)
+        orbitals = pyparse.needed_orbitals(
+            pyparse.parse_file(logfile),
+            scale,
+            states,
+            pyparse.num_basis_functions(header, pyargs),
         )
-    )
-else:
-    template = Template(
-          (
-              "\nopen {{ name }}"
-              "\npreset apply pub {{ preset }}; color byelement"
-              "\nvolume #1 level -{{ level }} color {{ minus }}"
-              " level {{ level }} color {{ plus }} step {{ cubres }}"
-              "\nbackground solid {{ bgcolor }}"
-              "\nsetattr M stickScale 0.6 #; unset depthCue"
-              "\ncopy file {{ output }} supersample {{ supsam }} "
-              "dpi {{ dpi }} width {{ width }} units {{units}}"
-              "\nclose #1"
-          )
-      )
-
-if args.stephan:
-    template = Template(
+        selected["orb"] = [cube for cube in cubes["orb"] if cube_number(cube) in orbitals]
+    return selected
+
+
+def get_settings(args):
+    """define the quality and the colors of the resulting images"""
+    settings = {
+        # color preset is the publication preset that can be set in chimera
+        "preset": "2",
+        # cube resolution 1 means 'use every point', 2 would be use every 2nd point
+        "cubres": "1",
+        # super sampling of the final image
+        "supsam": str(args.supersampling),
+        # pixel density
+        "dpi": str(args.dpi),
+        # image width for CDD, electron and hole for docx
+        "cdd_width": args.cdd_image_width,  # cm
+        # image width for MOs for docx
+        "mo_width": args.mo_image_width,  # cm
+        # image units
+        "units": args.image_units,
+        # image type ... could also be png
+        "filetype": str(args.filetype),
+        # background color
+        "bgcolor": str(args.background),
+        # the isovalue for the MOs
+        "orb_level": "0.04",
+        # the isovalue for densities
+        "cdd_level": "0.002",
+        # the RGB colors for MOs
+        "orbRGB": [["0", ".5", ".6"], [".9", ".7", ".1"]],
+        # the RGB colors for 'regular' densities
+        "cddRGB": [["0", "0.8", "1"], ["1", "0.2", "0"]],
+        # the RGB for spin densities
+        "sdRGB": [["0", "0.2", "0.6"], ["0", "0.6", "0.3"]],
+        # the enlargement for the image size ... window size multiplier
+        "size_factor": args.sizefactor,
+    }
+
+    # stephan's colors and a preset to fit GaussView more or less
+    if args.stephan:
+        settings["orbRGB"] = [["0.0", "0.4", "0.0"], ["1.0", "1.0", "0.0"]]
+        settings["cddRGB"] = [["1.0", "0.0", "0.0"], ["0.0", "0.47451", "1.0"]]
+        settings["preset"] = "4"
+
+    # abs cubes
+    if args.abs_cubes:
+        settings["cdd_level"] = settings["orb_level"]
+
+    return settings
+
+
+def get_template(args):
+    """template for easy use when creating the output"""
+    if args.stephan:
+        return Template(
+            (
+                "\nopen {{ name }}"
+                "\npreset apply pub {{ preset }}; color byelement"
+                "\nvolume #1 level -{{ level }} color {{ minus }}"
+                " level {{ level }} color {{ plus }} step {{ cubres }}"
+                "\nbackground solid {{ bgcolor }}"
+                "\nsetattr M stickScale 0.6 #; unset depthCue; unset shadows"
+                "\ncopy file {{ output }} supersample {{ supsam }} "
+                "dpi {{ dpi }} width {{ width }} units {{ units }}"
+                "\nclose #1"
+            )
+        )
+    # if the image should be rendered with PovRay, activate the raytrace part
+    if args.raytrace:
+        return Template(
+            (
+                "\nopen {{ name }}"
+                "\npreset apply pub {{ preset }}; color byelement"
+                "\nvolume #1 level -{{ level }} color {{ minus }}"
+                " level {{ level }} color {{ plus }} step {{ cubres }}"
+                "\nbackground solid {{ bgcolor }}"
+                "\nsetattr M stickScale 0.6 #; unset depthCue"
+                "\ncopy file {{ output }} supersample {{ supsam }} "
+                "dpi {{ dpi }} width {{ width }} units {{ units }}"
+                'raytrace rtwait'
+                "\nclose #1"
+            )
+        )
+    return Template(
         (
             "\nopen {{ name }}"
             "\npreset apply pub {{ preset }}; color byelement"
             "\nvolume #1 level -{{ level }} color {{ minus }}"
             " level {{ level }} color {{ plus }} step {{ cubres }}"
             "\nbackground solid {{ bgcolor }}"
-            "\nsetattr M stickScale 0.6 #; unset depthCue; unset shadows"
+            "\nsetattr M stickScale 0.6 #; unset depthCue"
             "\ncopy file {{ output }} supersample {{ supsam }} "
-            "dpi {{ dpi }} width {{ width }} units {{ units }}"
+            "dpi {{ dpi }} width {{ width }} units {{units}}"
             "\nclose #1"
         )
     )
 
-# open the session, apply the color preset, set dpi etc for the geometry image and save it
-mytext = "open " + session
-mytext += "\npreset apply pub " + ColorPreset + "; color byelement"
-mytext += "\nbackground solid " + backgroundcolor + "; setattr M stickScale 0.6 #"
-if args.stephan:
-    mytext += "\nunset depthCue; unset shadows"
-mytext += "\ncopy file geometry." + FileType + " supersample " + SuperSample
-mytext += " dpi " + DPI + " width " + str(int(sizeFactor * WWidth))
-mytext += " height " + str(int(sizeFactor * WHeight))
-
-# for every CDD add the resp. commands to the output
-for cdd in cdds:
-    mytext += template.render(
-        name=cdd,
-        preset=ColorPreset,
-        level=cddLevel,
-        cubres=CubeResolution,
-        output=cdd.replace("cub", FileType),
-        supsam=SuperSample,
-        dpi=DPI,
-        bgcolor=backgroundcolor,
-        width=str(CDDimagewidth),
-        units=units,
-        minus=",".join(cddRGB[0]),
-        plus=",".join(cddRGB[1]),
-    )
-# for every ORCA_plot CDD add the resp. commands to the output
-for cdd in orca_cdds:
-    mytext += template.render(
-        name=cdd,
-        preset=ColorPreset,
-        level=cddLevel,
-        cubres=CubeResolution,
-        output=cdd.replace("cube", FileType),
-        supsam=SuperSample,
-        dpi=DPI,
-        bgcolor=backgroundcolor,
-        width=str(CDDimagewidth),
-        units=units,
-        minus=",".join(cddRGB[0]),
-        plus=",".join(cddRGB[1]),
-    )
-# same for electron
-for ele in eles:
-    mytext += template.render(
-        name=ele,
-        preset=ColorPreset,
-        level=cddLevel,
-        cubres=CubeResolution,
-        output=ele.replace("cub", FileType),
-        supsam=SuperSample,
-        dpi=DPI,
-        bgcolor=backgroundcolor,
-        width=str(CDDimagewidt),
-        units=units,
-        minus=",".join(cddRGB[0]),
-        plus=",".join(cddRGB[1]),
-    )
-# ... for hole
-for hol in hols:
-    mytext += template.render(
-        name=hol,
-        preset=ColorPreset,
-        level=cddLevel,
-        cubres=CubeResolution,
-        output=hol.replace("cub", FileType),
-        supsam=SuperSample,
-        dpi=DPI,
-        bgcolor=backgroundcolor,
-        width=str(CDDimagewidth),
-        units=units,
-        minus=",".join(cddRGB[1]),
-        plus=",".join(cddRGB[0]),
-    )
-# ... for MOs
-for orb in orbs:
-    mytext += template.render(
-        name=orb,
-        preset=ColorPreset,
-        level=orbLevel,
-        cubres=CubeResolution,
-        output=orb.replace("cub", FileType),
-        supsam=SuperSample,
-        dpi=DPI,
-        bgcolor=backgroundcolor,
-        width=str(MOimagewidth),
-        units=units,
-        minus=",".join(orbRGB[0]),
-        plus=",".join(orbRGB[1]),
-    )
-# ... for spin density
-for sd in spindensity:
-    mytext += template.render(
-        name=sd,
-        preset=ColorPreset,
-        level=cddLevel,
-        cubres=CubeResolution,
-        output=sd.replace("cub", FileType),
-        supsam=SuperSample,
-        dpi=DPI,
-        bgcolor=backgroundcolor,
-        width=str(int(sizeFactor * WWidth)),
-        height=str(int(sizeFactor * WHeight)),
-        minus=",".join(sdRGB[0]),
-        plus=",".join(sdRGB[1]),
+
+def session_header(session, args, settings, WWidth, WHeight, geometry=True):
+    """open the session, apply the color preset, set dpi etc for the geometry image and save it"""
+    mytext = "open " + session
+    mytext += "\npreset apply pub " + settings["preset"] + "; color byelement"
+    mytext += "\nbackground solid " + settings["bgcolor"] + "; setattr M stickScale 0.6 #"
+    if args.stephan:
+        mytext += "\nunset depthCue; unset shadows"
+    if geometry:
+        mytext += "\ncopy file geometry." + settings["filetype"]
+        mytext += " supersample " + settings["supsam"]
+        mytext += " dpi " + settings["dpi"]
+        mytext += " width " + str(int(settings["size_factor"] * WWidth))
+        mytext += " height " + str(int(settings["size_factor"] * WHeight))
+    return mytext
+
+
+def build_jobs(cubes, settings, WWidth, WHeight):
+    """one dict of template arguments for every cube that should be rendered"""
+    jobs = []
+    FileType = settings["filetype"]
+    common = {
+        "preset": settings["preset"],
+        "cubres": settings["cubres"],
+        "supsam": settings["supsam"],
+        "dpi": settings["dpi"],
+        "bgcolor": settings["bgcolor"],
+    }
+    orbRGB = settings["orbRGB"]
+    cddRGB = settings["cddRGB"]
+    sdRGB = settings["sdRGB"]
+    # the session sized images for spin and transition densities
+    window = {
+        "width": str(int(settings["size_factor"] * WWidth)),
+        "height": str(int(settings["size_factor"] * WHeight)),
+    }
+
+    # for every CDD add the resp. commands to the output
+    for cdd in cubes["cdd"]:
+        jobs.append(dict(
+            common,
+            name=cdd,
+            kind="cdd",
+            level=settings["cdd_level"],
+            output=cdd.replace("cub", FileType),
+            width=str(settings["cdd_width"]),
+            units=settings["units"],
+            minus=",".join(cddRGB[0]),
+            plus=",".join(cddRGB[1]),
+        ))
+    # for every ORCA_plot CDD add the resp. commands to the output
+    for cdd in cubes["orca_cdd"]:
+        jobs.append(dict(
+            common,
+            name=cdd,
+            kind="orca_cdd",
+            level=settings["cdd_level"],
+            output=cdd.replace("cube", FileType),
+            width=str(settings["cdd_width"]),
+            units=settings["units"],
+            minus=",".join(cddRGB[0]),
+            plus=",".join(cddRGB[1]),
+        ))
+    # same for electron
+    for ele in cubes["electron"]:
+        jobs.append(dict(
+            common,
+            name=ele,
+            kind="electron",
+            level=settings["cdd_level"],
+            output=ele.replace("cub", FileType),
+            width=str(settings["cdd_width"]),
+            units=settings["units"],
+            minus=",".join(cddRGB[0]),
+            plus=",".join(cddRGB[1]),
+        ))
+    # ... for hole
+    for hol in cubes["hole"]:
+        jobs.append(dict(
+            common,
+            name=hol,
+            kind="hole",
+            level=settings["cdd_level"],
+            output=hol.replace("cub", FileType),
+            width=str(settings["cdd_width"]),
+            units=settings["units"],
+            minus=",".join(cddRGB[1]),
+            plus=",".join(cddRGB[0]),
+        ))
+    # ... for MOs
+    for orb in cubes["orb"]:
+        jobs.append(dict(
+            common,
+            name=orb,
+            kind="orb",
+            level=settings["orb_level"],
+            output=orb.replace("cub", FileType),
+            width=str(settings["mo_width"]),
+            units=settings["units"],
+            minus=",".join(orbRGB[0]),
+            plus=",".join(orbRGB[1]),
+        ))
+    # ... for spin density
+    for sd in cubes["spindensity"]:
+        jobs.append(dict(
+            common,
+            **window,
+            name=sd,
+            kind="spindensity",
+            level=settings["cdd_level"],
+            output=sd.replace("cub", FileType),
+            minus=",".join(sdRGB[0]),
+            plus=",".join(sdRGB[1]),
+        ))
+    # ... for transition densities
+    for td in cubes["transdens"]:
+        jobs.append(dict(
+            common,
+            **window,
+            name=td,
+            kind="transdens",
+            level=settings["cdd_level"],
+            output=td.replace("cub", FileType),
+            minus=",".join(cddRGB[0]),
+            plus=",".join(cddRGB[1]),
+        ))
+    return jobs
+
+
+def file_hash(filename):
+    """sha256 of a file, read in chunks to keep big cubes out of memory"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 24), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(filename=MANIFEST):
+    """read the render manifest ... output: hash of the cube and the render commands"""
+    try:
+        with open(filename) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(manifest, filename=MANIFEST):
+    with open(filename, "w") as handle:
+        json.dump(manifest, handle, indent=1, sort_keys=True)
+
+
+def manifest_entry(manifest, output, source, commands):
+    """the manifest entry for the current source file and render commands
+
+    the source is only hashed again when its size or mtime changed
+    """
+    stat = os.stat(source)
+    entry = {
+        "source": source,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "params": hashlib.sha256(commands.encode()).hexdigest(),
+    }
+    old = manifest.get(output, {})
+    if all(old.get(key) == entry[key] for key in ("source", "size", "mtime")):
+        entry["hash"] = old.get("hash")
+    else:
+        entry["hash"] = file_hash(source)
+    return entry
+
+
+def image_stamp(output):
+    """mtime and size of an image, None if it doesn't exist"""
+    try:
+        stat = os.stat(output)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def is_up_to_date(manifest, output, entry):
+    """the image exists and was rendered from the same cube with the same settings"""
+    old = manifest.get(output)
+    return (
+        os.path.exists(output)
+        and old is not None
+        and old.get("hash") == entry["hash"]
+        and old.get("params") == entry["params"]
     )
-# ... for transition densities
-for td in transdens:
-    mytext += template.render(
-        name=td,
-        preset=ColorPreset,
-        level=cddLevel,
-        cubres=CubeResolution,
-        output=td.replace("cub", FileType),
-        supsam=SuperSample,
-        dpi=DPI,
-        bgcolor=backgroundcolor,
-        width=str(int(sizeFactor * WWidth)),
-        height=str(int(sizeFactor * WHeight)),
-        minus=",".join(cddRGB[0]),
-        plus=",".join(cddRGB[1]),
+
+
+def auto_level(job, fraction, cache):
+    """the isovalue enclosing the fraction of the density of the job's cube"""
+    from cubetools import load_cube, read_cube, auto_isovalue
+
+    cube = load_cube(job["name"]) if cache else read_cube(job["name"])
+    power = 2 if job["kind"] == "orb" else 1
+    return f"{auto_isovalue(cube.data, fraction, power):.3g}"
+
+
+def auto_levels(jobs, args, manifest):
+    """per cube isovalues, reused from the manifest as long as the cube didn't change"""
+    levels = {}
+    missing = []
+    for job in jobs:
+        old = manifest.get(job["output"], {})
+        stat = os.stat(job["name"])
+        if (
+            old.get("fraction") == args.auto_isovalue
+            and old.get("source") == job["name"]
+            and (old.get("size"), old.get("mtime")) == (stat.st_size, stat.st_mtime)
+        ):
+            levels[job["name"]] = old["level"]
+        else:
+            missing.append(job)
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        computed = pool.map(
+            auto_level,
+            missing,
+            [args.auto_isovalue] * len(missing),
+            [args.cube_cache] * len(missing),
+        )
+        levels.update(zip((job["name"] for job in missing), computed))
+    return [dict(job, level=levels[job["name"]]) for job in jobs]
+
+
+def slim_job(job, args):
+    """downsample and crop the cube of one job, chimera then opens the slim copy"""
+    from cubetools import slim_cube, CACHE_DIR
+
+    level = float(job["level"]) if args.crop else None
+    cache_dir = CACHE_DIR if args.cube_cache else None
+    slimname = slim_cube(
+        job["name"], PREP_DIR, args.downsample, level, args.crop_margin, cache_dir
     )
-# end the input
-mytext += "\nstop"
+    return dict(job, name=slimname)
+
+
+def preprocess(jobs, args):
+    """shrink all cubes in parallel before they are rendered"""
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        return list(pool.map(slim_job, jobs, [args] * len(jobs)))
+
+
+def shard_jobs(jobs, n_shards):
+    """distribute the jobs over n shards, biggest cubes first, to the lightest shard"""
+    shards = [[] for _ in range(max(1, n_shards))]
+    loads = [0] * len(shards)
+    for job in sorted(jobs, key=lambda job: os.path.getsize(job["name"]), reverse=True):
+        k = loads.index(min(loads))
+        shards[k].append(job)
+        loads[k] += os.path.getsize(job["name"])
+    return [shard for shard in shards if shard] or [[]]
+
+
+def write_shards(shards, template, header, geometry_header):
+    """write one chimera input per shard, only the first one renders the geometry"""
+    cmdfiles = []
+    for k, shard in enumerate(shards):
+        mytext = geometry_header if k == 0 else header
+        # for every cube add the resp. commands to the output
+        for job in shard:
+            mytext += template.render(**job)
+        # end the input
+        mytext += "\nstop"
+
+        cmdfile = "input.cmd" if len(shards) == 1 else f"input_{k:03}.cmd"
+        with open(cmdfile, "w") as f:
+            f.write(mytext)
+        cmdfiles.append(cmdfile)
+    return cmdfiles
+
+
+def job_record(job, cwd, start, end, status, args):
+    """one line of the render log"""
+    cube = os.path.join(cwd, job["name"])
+    output = os.path.join(cwd, job["output"])
+    return {
+        "directory": cwd,
+        "kind": job.get("kind"),
+        "cube": job["name"],
+        "cube_size": os.path.getsize(cube) if os.path.exists(cube) else None,
+        "output": job["output"],
+        "output_size": os.path.getsize(output) if os.path.exists(output) else None,
+        "start": start,
+        "end": end,
+        "seconds": round(end - start, 3),
+        "status": status,
+        "level": job.get("level"),
+        "supersample": job.get("supsam"),
+        "dpi": job.get("dpi"),
+        "width": job.get("width"),
+        "raytrace": args.raytrace,
+    }
+
+
+def log_jobs(records, progress):
+    """append the records to the JSON lines log and show the progress"""
+    with progress["lock"]:
+        with open(progress["log"], "a") as handle:
+            for record in records:
+                handle.write(json.dumps(record) + "\n")
+        for record in records:
+            progress["done"] += 1
+            print(
+                f"[{progress['done']:5d}/{progress['total']}] {record['seconds']:8.1f} s "
+                f"{record['status']:6} {os.path.join(record['directory'], record['output'])}",
+                flush=True,
+            )
+
+
+def run_chimera(cmdfile, jobs, cwd, args, progress):
+    """render one chimera input and time its images while chimera is running
+
+    chimera renders the images one after the other, so an image is done when
+    its file changes and took the time since the previous image was done.
+    every image is checked on its own, a cube chimera can't render doesn't
+    hold up the images after it
+    """
+    command = ["chimera", "--bgopacity"]
+    if args.headless:
+        command += ["--nogui", "--offscreen"]
+    before = {job["output"]: image_stamp(os.path.join(cwd, job["output"])) for job in jobs}
+    remaining = list(jobs)
+    last = time.time()
+    process = subprocess.Popen(command + [cmdfile], cwd=cwd)
+
+    def written(job):
+        stamp = image_stamp(os.path.join(cwd, job["output"]))
+        return stamp is not None and stamp != before[job["output"]]
+
+    while remaining:
+        running = process.poll() is None
+        finished = [job for job in remaining if written(job)]
+        if finished:
+            now = time.time()
+            records = [job_record(finished[0], cwd, last, now, "ok", args)]
+            # images found in the same poll share the time
+            records += [job_record(job, cwd, now, now, "ok", args) for job in finished[1:]]
+            log_jobs(records, progress)
+            last = now
+            remaining = [job for job in remaining if job not in finished]
+        if not running:
+            break
+        time.sleep(POLL_INTERVAL)
+    status = process.wait()
+    now = time.time()
+    # images written between the last poll and the exit
+    finished = [job for job in remaining if written(job)]
+    remaining = [job for job in remaining if job not in finished]
+    records = [job_record(job, cwd, last, now, "ok", args) for job in finished]
+    records += [job_record(job, cwd, last, now, "failed", args) for job in remaining]
+    if records:
+        log_jobs(records, progress)
+    if status == 0 and not remaining and not args.keep_inputs:
+        os.remove(os.path.join(cwd, cmdfile))
+    elif status != 0:
+        print(f"chimera failed on {cmdfile} with exit status {status}")
+    return status if status != 0 else len(remaining)
+
+
+@contextmanager
+def working_directory(path):
+    """run the discovery and bookkeeping of a molecule inside its directory"""
+    old = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old)
+
+
+def prepare(args):
+    """find session and cubes of the current directory and write its chimera inputs
+
+    returns what finish() needs after rendering, None without a single session
+    """
+    # find the session file and all relevant cube files
+    session = find_session()
+    if session is None:
+        return None
+    cubes = find_cubes()
+
+    # get the window size to change it later
+    WWidth, WHeight = WindowSize(session)[1:3]
+    WWidth = int(WWidth)
+    WHeight = int(WHeight)
+
+    if args.states:
+        cubes = wanted_cubes(cubes, args.states, args.gaussian_log)
+
+    settings = get_settings(args)
+    template = get_template(args)
+    jobs = build_jobs(cubes, settings, WWidth, WHeight)
+    header = session_header(session, args, settings, WWidth, WHeight, geometry=False)
+    geometry_header = session_header(session, args, settings, WWidth, WHeight)
+
+    # skip everything that has been rendered before with the same cube and settings,
+    # --force renders everything again but keeps the entries of the other images
+    manifest = read_manifest()
+
+    def up_to_date(output, entry):
+        return not args.force and is_up_to_date(manifest, output, entry)
+
+    # pick the isovalue of every cube from its grid
+    if args.auto_isovalue:
+        jobs = auto_levels(jobs, args, {} if args.force else manifest)
+
+    prep = f"\n# downsample {args.downsample} crop {args.crop} margin {args.crop_margin}"
+    entries = {}
+    geometry = "geometry." + settings["filetype"]
+    entries[geometry] = manifest_entry(manifest, geometry, session, geometry_header)
+    todo = []
+    for job in jobs:
+        entry = manifest_entry(
+            manifest, job["output"], job["name"], header + template.render(**job) + prep
+        )
+        if args.auto_isovalue:
+            entry.update(level=job["level"], fraction=args.auto_isovalue)
+        entries[job["output"]] = entry
+        if not up_to_date(job["output"], entry):
+            todo.append(job)
+
+    run = {
+        "jobs": jobs,
+        "entries": entries,
+        "manifest": manifest,
+        "before": {output: image_stamp(output) for output in entries},
+        "shards": [],
+    }
+    if not up_to_date(geometry, entries[geometry]):
+        header_0 = geometry_header
+    elif todo:
+        header_0 = header
+    else:
+        print("All images are up to date.")
+        return run
+    print(f"{len(todo)} of {len(jobs)} cube images need to be rendered")
+
+    # shrink the cubes before chimera has to load every grid point
+    if todo and (args.downsample > 1 or args.crop):
+        todo = preprocess(todo, args)
+
+    # the python backend draws every image in its own process, no chimera inputs
+    if args.backend == "python":
+        # the geometry image is drawn from the atoms of the first cube
+        if header_0 == geometry_header and jobs:
+            geometry_job = {
+                "kind": "geometry",
+                "name": jobs[0]["name"],
+                "output": geometry,
+                "width": str(int(settings["size_factor"] * WWidth)),
+                "height": str(int(settings["size_factor"] * WHeight)),
+                "dpi": settings["dpi"],
+                "supsam": settings["supsam"],
+                "bgcolor": settings["bgcolor"],
+            }
+            todo = [geometry_job] + todo
+        run["shards"] = [(None, [dict(job, cache=args.cube_cache)]) for job in todo]
+        return run
+
+    # write the inputs
+    shards = shard_jobs(todo, args.workers)
+    cmdfiles = write_shards(shards, template, header, header_0)
+    # the jobs chimera works through per input, the geometry image comes first
+    if header_0 == geometry_header:
+        shards[0] = [{"kind": "geometry", "name": session, "output": geometry}] + shards[0]
+    run["shards"] = list(zip(cmdfiles, shards))
+    return run
+
+
+def finish(run, args):
+    """update the render manifest and write the thumbnails of the current directory"""
+    # only remember the images that were actually written in this run, the
+    # entries of all other images stay as they were
+    manifest = run["manifest"]
+    for output, entry in run["entries"].items():
+        stamp = image_stamp(output)
+        if stamp is not None and stamp != run["before"][output]:
+            manifest[output] = entry
+    write_manifest(manifest)
+
+    # the *_thumb images that pyparse.py puts into the docx table
+    if args.thumbnails:
+        from thumbnails import make_thumbs
+
+        thumbs = make_thumbs(
+            [job["output"] for job in run["jobs"] if os.path.exists(job["output"])],
+            args.cdd_image_width,
+            args.mo_image_width,
+            args.thumb_dpi,
+            args.workers,
+        )
+        print(f"{len(thumbs)} thumbnails written")
+
+
+def render(runs, args):
+    """render the inputs of all directories with one pool of chimera processes
+
+    every directory is finished as soon as its last input is rendered, an
+    error in one directory only fails that one. returns the failed directories
+    """
+    pending = {directory: len(run["shards"]) for directory, run in runs.items()}
+    failed = {directory: 0 for directory in runs}
+    progress = {
+        "done": 0,
+        "total": sum(len(jobs) for run in runs.values() for _, jobs in run["shards"]),
+        "lock": threading.Lock(),
+        "log": os.path.abspath(args.log),
+    }
+
+    def done(directory):
+        with working_directory(directory):
+            finish(runs[directory], args)
+        status = "failed" if failed[directory] else "done"
+        print(
+            f"{directory}: {status} ({len(runs[directory]['shards'])} renders, "
+            f"{failed[directory]} failed)"
+        )
+
+    if args.backend == "python":
+        from isorender import render_job
+
+        pool = ProcessPoolExecutor(max_workers=max(1, args.workers))
+    else:
+        pool = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    with pool:
+        futures = {}
+        for directory, run in runs.items():
+            for cmdfile, jobs in run["shards"]:
+                if args.backend == "python":
+                    future = pool.submit(render_job, jobs[0], directory)
+                else:
+                    future = pool.submit(run_chimera, cmdfile, jobs, directory, args, progress)
+                futures[future] = (directory, jobs)
+        for directory, n in pending.items():
+            if n == 0:
+                done(directory)
+        for future in as_completed(futures):
+            directory, jobs = futures[future]
+            pending[directory] -= 1
+            try:
+                if args.backend == "python":
+                    start, end, status = future.result()
+                    log_jobs([job_record(jobs[0], directory, start, end, status, args)], progress)
+                    failed[directory] += status != "ok"
+                else:
+                    failed[directory] += future.result() != 0
+            except Exception as error:
+                # e.g. no chimera binary, the other directories go on
+                print(f"{directory}: {error}")
+                now = time.time()
+                log_jobs([job_record(job, directory, now, now, "failed", args) for job in jobs], progress)
+                failed[directory] += 1
+            if pending[directory] == 0:
+                done(directory)
+    return [directory for directory, n in failed.items() if n]
+
+
+def main():
+    # parse the arguments
+    args = getinput(sys.argv[1:])
+
+    with timings.session(args):
+        runs = {}
+        for directory in [os.path.abspath(path) for path in args.batch or ["."]]:
+            with working_directory(directory), timings.stage(
+                f"prepare {os.path.basename(directory)}"
+            ):
+                run = prepare(args)
+            if run is None:
+                print(f"{directory}: skipped, no single chimera session")
+                continue
+            runs[directory] = run
+        if not runs:
+            return
+
+        # execute the inputs
+        if args.backend == "python" or platform.system() == "Linux":
+            with timings.stage("render"):
+                failed = render(runs, args)
+            if failed:
+                print(f"{len(failed)} of {len(runs)} directories failed")
+                return 1
 
-# write the input
-with open("input.cmd", "w") as f:
-    f.write(mytext)
 
-# execute the input
-if platform.system() == "Linux":
-    os.system("chimera --bgopacity input.cmd")
-    os.remove("input.cmd")
+if __name__ == "__main__":
+    sys.exit(main())
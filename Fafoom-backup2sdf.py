@@ -11,6 +11,38 @@ import sys
 import os
 import errno
 import re
+import argparse
+
+import timings
+
+# fafoom writes every structure as MoleculeStructure(attribute=value, ...)
+# with the sdf strings quoted and their new lines replaced by NEWLINE
+RECORD = re.compile(r"MoleculeStructure\(")
+QUOTED = re.compile(r"'(.*?)'", re.DOTALL)
+NUMBER = r"([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+FIELDS = {
+    'index': re.compile(r"\bindex\s*=\s*(\d+)"),
+    'generation': re.compile(r"\bgeneration\s*=\s*(\d+)"),
+    'energy': re.compile(r"\benergy\s*=\s*" + NUMBER),
+}
+# the first values=[...] list, the torsion angles of the dof
+TORSIONS = re.compile(r"values\s*=\s*\[([^\]]*)\]")
+COLUMNS = ['index', 'generation', 'energy']
+
+
+def get_input(args):
+    """Parses the command line."""
+    parser = argparse.ArgumentParser(
+        description='fafoom backup_{population,blacklist}.dat to sdf')
+    parser.add_argument(
+        'backup', help='backup_population.dat or backup_blacklist.dat')
+    parser.add_argument(
+        '--coordinates', '-c', action='store_true',
+        help='also write all coordinates as one float32 array to '
+        '{population,blacklist}_coords.npy and the elements to _elements.json')
+    timings.add_arguments(parser)
+    return parser.parse_args(args)
+
 
 # this function is from http://stackoverflow.com/a/10840586
 def silentremove(filename):
@@ -24,10 +56,166 @@ def silentremove(filename):
             # re-raise exception if a different error occured
             raise
 
-def convert_backup(filename):
-    """Converts backup_{population,blacklist}.dat into a sdf-file."""
-    filestring = open(filename, 'r').read()
-    geometries = re.findall(r"'(.*?)'", filestring, re.DOTALL)
+def sdf_blocks(geometries, iszero=0):
+    """The optimized geometries as sdf blocks.
+
+    Every structure has two NEWLINE strings, the initial geometry and the
+    optimized one. iszero is 1 if the next one is an optimized geometry,
+    it is returned as well so a backup can be converted in pieces.
+    """
+    blocks = []
+    for geometry in geometries:
+        if "NEWLINE" in geometry:
+            if iszero == 1:
+                line = "\n".join(geometry.split("NEWLINE"))
+                blocks.append(line+'$$$$\n')
+                iszero = 0
+            else:
+                iszero = 1
+    return blocks, iszero
+
+def split_records(filestring):
+    """The structures of a backup, one MoleculeStructure(...) or one line each."""
+    if RECORD.search(filestring):
+        parts = RECORD.split(filestring)[1:]
+    else:
+        parts = filestring.splitlines()
+    return [part for part in parts if "NEWLINE" in part]
+
+def record_metadata(record):
+    """Energy, index, generation and torsion values of a structure, None
+    for everything that isn't in the record."""
+    # the sdf strings may contain anything, so they are not searched
+    rest = QUOTED.sub("''", record)
+    meta = {}
+    for name, pattern in FIELDS.items():
+        match = pattern.search(rest)
+        if match is None:
+            meta[name] = None
+        elif name == 'energy':
+            meta[name] = float(match.group(1))
+        else:
+            meta[name] = int(match.group(1))
+    match = TORSIONS.search(rest)
+    if match is None:
+        meta['torsions'] = []
+    else:
+        meta['torsions'] = [
+            float(value) for value in match.group(1).split(',') if value.strip()]
+    return meta
+
+def add_fields(block, meta):
+    """Adds the metadata as sdf data fields in front of the $$$$ line."""
+    fields = ''
+    for name in COLUMNS:
+        if meta.get(name) is not None:
+            fields += '> <%s>\n%s\n\n' % (name, meta[name])
+    if meta.get('torsions'):
+        fields += '> <torsions>\n%s\n\n' % ' '.join(
+            '%.2f' % value for value in meta['torsions'])
+    molblock = block[:-len('$$$$\n')]
+    if not molblock.endswith('\n'):
+        molblock += '\n'
+    return molblock + fields + '$$$$\n'
+
+def convert_records(filestring, iszero=0):
+    """The sdf blocks with data fields and the metadata of every structure.
+
+    iszero is carried from record to record like in sdf_blocks, so backups
+    with the initial and the optimized geometry on lines of their own work
+    too. It is returned as well, for converting a backup in pieces.
+    """
+    blocks = []
+    metas = []
+    records = split_records(filestring)
+    if not records:
+        # unknown layout, only the geometries
+        blocks, iszero = sdf_blocks(QUOTED.findall(filestring), iszero)
+        return blocks, [{} for _ in blocks], iszero
+    for record in records:
+        meta = record_metadata(record)
+        record_blocks, iszero = sdf_blocks(QUOTED.findall(record), iszero)
+        for block in record_blocks:
+            blocks.append(add_fields(block, meta))
+            metas.append(meta)
+    return blocks, metas, iszero
+
+def write_metadata(basename, metas):
+    """Writes the metadata as columns to basename.csv and basename.npz.
+
+    The npz holds the arrays index, generation (-1 if unknown), energy and
+    torsions (n_structures x n_torsions, both nan if unknown).
+    """
+    import numpy as np
+
+    n_torsions = max([len(meta.get('torsions') or []) for meta in metas] + [0])
+    with open(basename + '.csv', 'w') as csvfile:
+        csvfile.write(','.join(
+            COLUMNS + ['torsion_%d' % (k + 1) for k in range(n_torsions)]) + '\n')
+        for meta in metas:
+            torsions = meta.get('torsions') or []
+            values = [meta.get(name) for name in COLUMNS] + torsions
+            values += [None] * (n_torsions - len(torsions))
+            csvfile.write(','.join(
+                '' if value is None else repr(value) for value in values) + '\n')
+
+    def column(name, dtype, missing):
+        return np.array([missing if meta.get(name) is None else meta[name]
+                         for meta in metas], dtype=dtype)
+
+    torsions = np.full((len(metas), n_torsions), np.nan)
+    for k, meta in enumerate(metas):
+        values = meta.get('torsions') or []
+        torsions[k, :len(values)] = values
+    np.savez(basename + '.npz',
+             index=column('index', np.int64, -1),
+             generation=column('generation', np.int64, -1),
+             energy=column('energy', float, np.nan),
+             torsions=torsions)
+
+def molblock_atoms(block):
+    """The element symbols and the (n_atoms, 3) coordinates of a V2000 molblock."""
+    lines = block.split('\n')
+    n_atoms = int(lines[3][:3])
+    atoms = [line.split() for line in lines[4:4 + n_atoms]]
+    return [atom[3] for atom in atoms], [atom[:3] for atom in atoms]
+
+def write_coordinates(basename, blocks):
+    """Writes the coordinates of all structures as one memory-mappable float32
+    array (n_structures x n_atoms x 3) to basename_coords.npy and the element
+    symbols, the same for all structures, to basename_elements.json.
+
+    Structures with other atoms than the first one are filled with nan.
+    """
+    import json
+    import numpy as np
+
+    if not blocks:
+        return
+    elements, _ = molblock_atoms(blocks[0])
+    coords = np.lib.format.open_memmap(
+        basename + '_coords.npy', mode='w+', dtype=np.float32,
+        shape=(len(blocks), len(elements), 3))
+    for k, block in enumerate(blocks):
+        symbols, xyz = molblock_atoms(block)
+        if symbols != elements:
+            print('structure %d has other atoms than the first one' % k)
+            coords[k] = np.nan
+            continue
+        coords[k] = np.array(xyz, dtype=np.float32)
+    coords.flush()
+    del coords
+    with open(basename + '_elements.json', 'w') as jsonfile:
+        json.dump(elements, jsonfile)
+
+def convert_backup(filename, coordinates=False):
+    """Converts backup_{population,blacklist}.dat into a sdf-file and its
+    metadata into {population,blacklist}_meta.{csv,npz}, with coordinates
+    also the packed coordinates of write_coordinates."""
+    with timings.stage('read'):
+        filestring = open(filename, 'r').read()
+    with timings.stage('records'):
+        blocks, metas, _ = convert_records(filestring)
 
     if "blacklist" in filename:
         sdfname = "blacklist.sdf"
@@ -36,17 +224,16 @@ def convert_backup(filename):
         sdfname = "population.sdf"
         silentremove(sdfname)
 
-    with open(sdfname, 'a') as sdffile:
-        iszero = 0
-        for geometry in geometries:
-            if "NEWLINE" in geometry:
-                if iszero == 1:
-                    line = "\n".join(geometry.split("NEWLINE"))
-                    sdffile.write(line+'$$$$\n')
-                    iszero = 0
-                else:
-                    iszero = 1
+    with open(sdfname, 'a') as sdffile, timings.stage('write sdf'):
+        sdffile.writelines(blocks)
+    with timings.stage('write metadata'):
+        write_metadata(os.path.splitext(sdfname)[0] + '_meta', metas)
+    if coordinates:
+        with timings.stage('write coordinates'):
+            write_coordinates(os.path.splitext(sdfname)[0], blocks)
 
 if __name__ == '__main__':
-    convert_backup(sys.argv[1])
+    ARGS = get_input(sys.argv[1:])
+    with timings.session(ARGS):
+        convert_backup(ARGS.backup, ARGS.coordinates)
 
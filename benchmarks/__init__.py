@@ -0,0 +1,5 @@
+""" benchmarks of the parsers and converters with synthetic inputs
+
+python -m benchmarks.synthetic  writes synthetic Gaussian, ORCA and fafoom files
+python -m benchmarks.run        times the scripts' functions across input sizes
+"""
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+""" times the parsers and converters on synthetic inputs of growing size
+
+python -m benchmarks.run --sizes 10 100 1000 --repeat 3
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from argparse import Namespace
+from contextlib import contextmanager, redirect_stdout
+
+from benchmarks import synthetic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from scripttools import load_script
+
+BENCHMARKS = ["parse_text", "parse_text-open", "to_docx", "get_socme", "calc_kISC",
+              "calc_kisc", "collect_scan", "convert_backup", "convert_backup-lines"]
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("time the scripts' functions on synthetic inputs")
+    )
+    parser.add_argument(
+        "--sizes",
+        "-s",
+        nargs="+",
+        default=[10, 100, 500],
+        type=int,
+        help="numbers of excited states, ORCA roots and fafoom geometries (default: 10 100 500)",
+    )
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=BENCHMARKS,
+        default=BENCHMARKS,
+        help="run only these benchmarks",
+    )
+    parser.add_argument(
+        "--repeat",
+        "-r",
+        default=3,
+        type=int,
+        help="timed runs per size, the best one is reported (default: 3)",
+    )
+    parser.add_argument(
+        "--excitations",
+        "-e",
+        default=10,
+        type=int,
+        help="excitations per Gaussian excited state (default: 10)",
+    )
+    parser.add_argument(
+        "--atoms",
+        "-a",
+        default=30,
+        type=int,
+        help="atoms per fafoom geometry (default: 30)",
+    )
+    parser.add_argument("--json", help="also write the results to this json file")
+
+    return parser.parse_args(args)
+
+
+@contextmanager
+def working_directory(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def measure(function, repeat):
+    """best wall time of repeat calls and the peak of traced memory of one more"""
+    times = []
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    # tracemalloc slows everything down, so it gets a run of its own
+    tracemalloc.start()
+    with redirect_stdout(io.StringIO()):
+        function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def setups(size, args, tmpdir):
+    """(benchmark name, function, input bytes, items) for one size"""
+    import pyparse
+    import getmat
+    import kISC
+
+    pyargs = Namespace(parser="pyparse", states=list(range(1, size + 1)), out="table.docx")
+
+    def gaussian(open_shell):
+        raw = synthetic.gaussian_log(size, args.excitations, open_shell)
+        return raw, lambda: pyparse.parse_text(raw, pyargs)
+
+    if "parse_text" in args.only:
+        raw, function = gaussian(False)
+        yield "parse_text", function, len(raw), size
+    if "parse_text-open" in args.only:
+        raw, function = gaussian(True)
+        yield "parse_text-open", function, len(raw), size
+    if "to_docx" in args.only:
+        raw = synthetic.gaussian_log(size, args.excitations)
+        content = pyparse.parse_text(raw, pyargs)
+        scale, _ = pyparse.is_closed_shell(raw, pyargs)
+
+        def docx():
+            with working_directory(tmpdir):
+                pyparse.to_docx(content, scale, pyargs, 952)
+
+        yield "to_docx", docx, len(raw), size
+
+    wanted = {"get_socme", "calc_kISC", "calc_kisc"} & set(args.only)
+    if wanted:
+        text = synthetic.orca_output(size)
+        lines = text.splitlines(keepends=True)
+        if "get_socme" in wanted:
+            yield "get_socme", lambda: getmat.get_socme(lines), len(text), size
+        with redirect_stdout(io.StringIO()):
+            singlets, triplets = getmat.get_orca_excited_states(lines)
+            socme, _ = getmat.get_socme(lines)
+        pairs = len(singlets) * len(triplets)
+        if "calc_kISC" in wanted:
+            yield "calc_kISC", lambda: getmat.calc_kISC(
+                singlets, triplets, socme, 1000.0
+            ), 0, pairs
+        if "calc_kisc" in wanted:
+            # kISC.py takes energies in Eh and the soc matrix singlets x triplets
+            yield "calc_kisc", lambda: kISC.calc_kisc(
+                singlets[:, 1] / 219474.63, triplets[:, 1] / 219474.63, socme, 1000.0
+            ), 0, pairs
+
+    if "collect_scan" in args.only:
+        # size steps of 20 roots each
+        import getmat
+
+        scan = os.path.join(tmpdir, "scan.out")
+        synthetic.write(scan, synthetic.orca_scan(size, 20))
+        yield "collect_scan", lambda: getmat.collect_scan(scan), os.path.getsize(scan), size
+
+    for name, lines in (("convert_backup", False), ("convert_backup-lines", True)):
+        if name not in args.only:
+            continue
+        fafoom = load_script("fafoom_backup2sdf", "Fafoom-backup2sdf.py")
+        backup = os.path.join(tmpdir, "backup_population.dat")
+        synthetic.write(backup, synthetic.fafoom_backup(size, args.atoms, lines=lines))
+
+        def convert():
+            with working_directory(tmpdir):
+                fafoom.convert_backup("backup_population.dat")
+
+        # every layout has to give all structures, else the timing means nothing
+        with redirect_stdout(io.StringIO()):
+            convert()
+        with open(os.path.join(tmpdir, "population.sdf")) as handle:
+            written = handle.read().count("$$$$")
+        if written != size:
+            raise RuntimeError(f"{name}: {written} of {size} structures written")
+        yield name, convert, os.path.getsize(backup), size
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    results = []
+    print(f"{'benchmark':16s} {'size':>6s} {'time/s':>9s} {'MB/s':>8s} {'items/s':>10s} {'peak/MB':>8s}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in args.sizes:
+            for name, function, nbytes, items in setups(size, args, tmpdir):
+                seconds, peak = measure(function, args.repeat)
+                result = {
+                    "benchmark": name,
+                    "size": size,
+                    "seconds": seconds,
+                    "bytes": nbytes,
+                    "items": items,
+                    "peak_bytes": peak,
+                }
+                results.append(result)
+                rate = f"{nbytes / seconds / 1e6:8.2f}" if nbytes else f"{'-':>8s}"
+                print(
+                    f"{name:16s} {size:6d} {seconds:9.4f} {rate} "
+                    f"{items / seconds:10.0f} {peak / 1e6:8.2f}"
+                )
+
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(results, handle, indent=1)
+
+
+if __name__ == "__main__":
+    main()
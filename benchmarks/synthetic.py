@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+""" synthetic Gaussian TDDFT logs, ORCA SOC outputs and fafoom backups of any size """
+
+import os
+import sys
+import argparse
+import random
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("write synthetic inputs for the benchmarks")
+    )
+    parser.add_argument(
+        "kind",
+        choices=["gaussian", "gaussian-open", "orca", "orca-scan", "fafoom", "fafoom-lines"],
+        help="input type",
+    )
+    parser.add_argument(
+        "size",
+        type=int,
+        help="number of excited states (gaussian, orca) or geometries (fafoom)",
+    )
+    parser.add_argument(
+        "--excitations",
+        "-e",
+        default=10,
+        type=int,
+        help="excitations per excited state of the gaussian logs (default: 10)",
+    )
+    parser.add_argument(
+        "--steps",
+        "-s",
+        default=100,
+        type=int,
+        help="TDDFT steps of an orca-scan output (default: 100)",
+    )
+    parser.add_argument(
+        "--atoms", "-a", default=30, type=int, help="atoms per fafoom geometry (default: 30)"
+    )
+    parser.add_argument("--out", "-o", required=True, help="output file")
+
+    return parser.parse_args(args)
+
+
+def gaussian_log(n_states, n_excitations=10, open_shell=False, seed=0):
+    """a Gaussian TDDFT log with n_states excited states of n_excitations each"""
+    rng = random.Random(seed)
+    homo = 200
+    lines = [
+        " Entering Gaussian System, Link 0=g16",
+        f" Charge =  0 Multiplicity = {2 if open_shell else 1}",
+        "   952 basis functions,  1755 primitive gaussians,  1014 cartesian basis functions",
+        " Excitation energies and oscillator strengths:",
+        "",
+    ]
+    for nr in range(1, n_states + 1):
+        energy = 1.5 + 0.05 * nr
+        wavelength = 1239.84 / energy
+        if open_shell:
+            lines.append(
+                f" Excited State {nr:3d}:  2.0{rng.randint(0, 99):02d}-A  "
+                f"{energy:10.4f} eV {wavelength:7.2f} nm  f={rng.random() / 10:.4f}  "
+                f"<S**2>={0.75 + rng.random() / 20:.3f}"
+            )
+        else:
+            lines.append(
+                f" Excited State {nr:3d}:      Singlet-A    {energy:10.4f} eV "
+                f"{wavelength:7.2f} nm  f={rng.random() / 10:.4f}  <S**2>=0.000"
+            )
+        for k in range(n_excitations):
+            origin = homo - rng.randint(0, 10)
+            target = homo + 1 + rng.randint(0, 10)
+            coefficient = rng.uniform(-0.7, 0.7)
+            if open_shell:
+                spin = rng.choice("AB")
+                arrow = "->" if k % 5 else "<-"
+                lines.append(
+                    f"     {origin}{spin} {arrow}{target}{spin}     {coefficient:10.5f}"
+                )
+            else:
+                arrow = "->" if k % 5 else "<-"
+                lines.append(f"     {origin} {arrow} {target}         {coefficient:8.5f}")
+        if nr == 1:
+            lines.append(" This state for optimization and/or second-order correction.")
+            lines.append(" Total Energy, E(TD-HF/TD-DFT) =  -1234.56789012")
+        lines.append("")
+    lines.append(" Normal termination of Gaussian 16.")
+    return "\n".join(lines) + "\n"
+
+
+def orca_output(n_roots, seed=0):
+    """an ORCA TDDFT output with n_roots singlets and triplets, both SOCME blocks
+    and the reduced ones"""
+    rng = random.Random(seed)
+    lines = [
+        "                                 * O   R   C   A *",
+        f"Number of roots to be determined               ...  {n_roots}",
+        "Total Energy       :       -12312.28056663 Eh         -335034.18703 eV",
+        "",
+        "-----------------------------------------------------------------------------",
+        "         ABSORPTION SPECTRUM VIA TRANSITION ELECTRIC DIPOLE MOMENTS",
+        "-----------------------------------------------------------------------------",
+        "State   Energy    Wavelength  fosc         T2        TX        TY        TZ",
+        "        (cm-1)      (nm)                 (au**2)    (au)      (au)      (au)",
+        "-----------------------------------------------------------------------------",
+    ]
+    for nr in range(1, n_roots + 1):
+        energy = 15000.0 + 300.0 * nr
+        lines.append(
+            f"  {nr:3d}   {energy:8.1f}   {1e7 / energy:6.1f}   {rng.random() / 10:.9f}"
+            "   0.00166   0.03728  -0.01632  -0.00020"
+        )
+    for nr in range(n_roots + 1, 2 * n_roots + 1):
+        energy = 12000.0 + 300.0 * (nr - n_roots)
+        lines.append(f"  {nr:3d}   {energy:8.1f}   {1e7 / energy:6.1f}   spin forbidden (mult=3)")
+    lines += [
+        "",
+        "-----------------------------------------------------------------------------",
+        "         ABSORPTION SPECTRUM VIA TRANSITION VELOCITY DIPOLE MOMENTS",
+        "-----------------------------------------------------------------------------",
+        "",
+    ]
+    lines += socme_blocks(n_roots, rng)
+    lines += reduced_socme_blocks(n_roots, rng)
+    lines.append("                             ****ORCA TERMINATED NORMALLY****")
+    return "\n".join(lines) + "\n"
+
+
+def socme_blocks(n_roots, rng):
+    """the lines of ORCA's xyz and M_S SOCME blocks"""
+    lines = []
+    for header in ("T      S              Z                    X                     Y",
+                   "T      S           MS= 0                  -1                    +1"):
+        lines += [
+            "-" * 80,
+            "                CALCULATED SOCME BETWEEN TRIPLETS AND SINGLETS",
+            "-" * 80,
+            "     Root                          <T|HSO|S>  (Re, Im) cm-1",
+            "   " + header,
+            "-" * 80,
+        ]
+        for t in range(1, n_roots + 1):
+            for s in range(0, n_roots + 1):
+                values = [rng.uniform(-10, 10) for _ in range(6)]
+                lines.append(
+                    f"   {t:3d}    {s:3d}    ({values[0]:.2e} , {values[1]:.2e})"
+                    f"    ({values[2]:.2e} , {values[3]:.2e})    ({values[4]:.2e} , {values[5]:.2e})"
+                )
+        lines.append("")
+    return lines
+
+
+def reduced_socme_blocks(n_roots, rng):
+    """the lines of ORCA's reduced singlet-triplet and triplet-triplet SOCME blocks,
+    real x y z and the triplets counted from 0, triplet pairs only once"""
+    lines = []
+    for title, pairs in (
+        ("TRIPLETS AND SINGLETS", [(t, s) for t in range(n_roots) for s in range(n_roots + 1)]),
+        ("TRIPLETS", [(t, u) for t in range(n_roots) for u in range(t, n_roots)]),
+    ):
+        lines += [
+            "-" * 80,
+            f"                CALCULATED REDUCED SOCME BETWEEN {title}",
+            "-" * 80,
+            "     Root                          <T|HSO|S>  cm-1",
+            "   T      S           X           Y           Z",
+            "-" * 80,
+        ]
+        for i, j in pairs:
+            x, y, z = (rng.uniform(-10, 10) for _ in range(3))
+            lines.append(f"   {i:3d}    {j:3d}    {x:10.4f}  {y:10.4f}  {z:10.4f}")
+        lines.append("")
+    return lines
+
+
+def orca_scan(n_steps, n_roots, socme=True, seed=0):
+    """an ORCA output with n_steps TDDFT calculations of n_roots singlets and
+    triplets each, like a scan or a multi xyz run"""
+    rng = random.Random(seed)
+    lines = [
+        "                                 * O   R   C   A *",
+        f"Number of roots to be determined               ...  {n_roots}",
+    ]
+    for step in range(n_steps):
+        lines += ["", f"         *    RELAXED SURFACE SCAN STEP {step + 1:4d}    *", ""]
+        for title, shift in (("SINGLETS", 0.5), ("TRIPLETS", 0.0)):
+            lines += [
+                "-" * 30,
+                f"TD-DFT/TDA EXCITED STATES ({title})",
+                "-" * 30,
+                "",
+            ]
+            for nr in range(1, n_roots + 1):
+                ev = 1.5 + shift + 0.1 * nr + 0.2 * rng.random()
+                lines += [
+                    f"STATE {nr:3d}:  E=   {ev / 27.211386:.6f} au {ev:10.3f} eV "
+                    f"{ev * 8065.544:10.1f} cm**-1 <S**2> =   0.000000",
+                    "   100a ->   101a  :     0.987654 (c= -0.99380771)",
+                    "",
+                ]
+        if socme:
+            lines += socme_blocks(n_roots, rng)
+        lines.append(f"FINAL SINGLE POINT ENERGY     {-1234.5 - rng.random():.9f}")
+    lines.append("                             ****ORCA TERMINATED NORMALLY****")
+    return "\n".join(lines) + "\n"
+
+
+def sdf_block(n_atoms, rng, title="fafoom"):
+    """a V2000 molblock of a chain of n_atoms carbon atoms"""
+    lines = [title, "     RDKit          3D", ""]
+    lines.append(f"{n_atoms:3d}{n_atoms - 1:3d}  0  0  0  0  0  0  0  0999 V2000")
+    for k in range(n_atoms):
+        x, y, z = 1.5 * k, rng.uniform(-1, 1), rng.uniform(-1, 1)
+        lines.append(f"{x:10.4f}{y:10.4f}{z:10.4f} C   0  0  0  0  0  0  0  0  0  0  0  0")
+    for k in range(1, n_atoms):
+        lines.append(f"{k:3d}{k + 1:3d}  1  0")
+    lines.append("M  END")
+    return "NEWLINE".join(lines) + "NEWLINE"
+
+
+def fafoom_backup(n_geometries, n_atoms=30, seed=0, lines=False):
+    """a fafoom backup_population.dat like file, one structure per line with the
+    initial and the optimized geometry as NEWLINE joined strings. with lines
+    only the quoted geometries, each on a line of its own"""
+    rng = random.Random(seed)
+    records = []
+    for index in range(n_geometries):
+        if lines:
+            records += [f"'{sdf_block(n_atoms, rng)}'", f"'{sdf_block(n_atoms, rng)}'"]
+            continue
+        values = ", ".join(f"{rng.uniform(-180, 180):.1f}" for _ in range(4))
+        records.append(
+            f"MoleculeStructure(index={index}, "
+            f"initial_sdf_string='{sdf_block(n_atoms, rng)}', "
+            f"sdf_string='{sdf_block(n_atoms, rng)}', "
+            f"energy={-1000 - rng.random():.8f}, "
+            f"dof=[Torsion(values=[{values}])], generation={index // 10})"
+        )
+    return "\n".join(records) + "\n"
+
+
+def write(filename, text):
+    with open(filename, "w") as handle:
+        handle.write(text)
+    return filename
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    if args.kind == "gaussian":
+        text = gaussian_log(args.size, args.excitations)
+    elif args.kind == "gaussian-open":
+        text = gaussian_log(args.size, args.excitations, open_shell=True)
+    elif args.kind == "orca":
+        text = orca_output(args.size)
+    elif args.kind == "orca-scan":
+        text = orca_scan(args.steps, args.size)
+    elif args.kind == "fafoom-lines":
+        text = fafoom_backup(args.size, args.atoms, lines=True)
+    else:
+        text = fafoom_backup(args.size, args.atoms)
+    write(args.out, text)
+    print(f"{args.out}: {os.path.getsize(args.out)} bytes")
+
+
+if __name__ == "__main__":
+    main()
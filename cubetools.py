@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+""" read, shrink and write Gaussian cube files (Multiwfn, ORCA, cubegen) """
+
+import os
+import sys
+import json
+import argparse
+from collections import namedtuple
+import numpy as np
+
+# comments: the two title lines
+# origin:   (3,) in bohr
+# counts:   (3,) number of points along the axes, negative for angstrom
+# axes:     (3, 3) step vectors, one per row
+# atoms:    (natoms, 5) atomic number, charge, x, y, z
+# mo_ids:   None or the list of MO numbers of an orbital cube
+# data:     (nx, ny, nz) grid, z runs fastest
+Cube = namedtuple("Cube", "comments origin counts axes atoms mo_ids data")
+
+# binary copies of the cubes: float32 grid as .npy plus the header as .json
+CACHE_DIR = "cubecache"
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("downsample and crop cube files before rendering them")
+    )
+    parser.add_argument("cubes", nargs="+", help="*.cub or *.cube files")
+    parser.add_argument(
+        "--downsample",
+        "-ds",
+        default=1,
+        type=int,
+        help="keep every n-th grid point along each axis (default: 1)",
+    )
+    parser.add_argument(
+        "--crop",
+        "-c",
+        type=float,
+        help="crop the grid to the region where |value| is at least this isovalue",
+    )
+    parser.add_argument(
+        "--margin",
+        "-m",
+        default=3,
+        type=int,
+        help="grid points kept around the cropped region (default: 3)",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"read the cubes through the binary cache in {CACHE_DIR}/",
+    )
+    parser.add_argument(
+        "--cache-only",
+        action="store_true",
+        help="only convert the cubes to the binary cache, don't write slim cubes",
+    )
+    parser.add_argument(
+        "--out-dir",
+        "-o",
+        default="slim",
+        help="directory for the slim cubes (default: slim)",
+    )
+
+    return parser.parse_args(args)
+
+
+def read_cube(filename):
+    """reads a cube file, the grid is streamed by numpy instead of python lines"""
+    with open(filename, "r") as handle:
+        comments = [handle.readline().rstrip("\n"), handle.readline().rstrip("\n")]
+        sline = handle.readline().split()
+        natoms = int(sline[0])
+        origin = np.array(sline[1:4], dtype=float)
+        nval = int(sline[4]) if len(sline) > 4 else 1
+        counts = []
+        axes = []
+        for _ in range(3):
+            sline = handle.readline().split()
+            counts.append(int(sline[0]))
+            axes.append([float(x) for x in sline[1:4]])
+        atoms = np.array(
+            [handle.readline().split()[:5] for _ in range(abs(natoms))], dtype=float
+        ).reshape(-1, 5)
+        # orbital cubes have a negative number of atoms and a line of MO numbers
+        mo_ids = None
+        if natoms < 0:
+            mo_ids = [int(x) for x in handle.readline().split()]
+            while len(mo_ids) < mo_ids[0] + 1:
+                mo_ids += [int(x) for x in handle.readline().split()]
+            mo_ids = mo_ids[1:]
+            nval = max(nval, len(mo_ids))
+        data = np.fromfile(handle, sep=" ")
+
+    shape = tuple(abs(n) for n in counts)
+    if nval > 1:
+        shape += (nval,)
+    return Cube(
+        comments, origin, np.array(counts), np.array(axes), atoms, mo_ids, data.reshape(shape)
+    )
+
+
+def cache_paths(filename, cache_dir=CACHE_DIR):
+    """the .npy grid and the .json header of a cached cube"""
+    base = os.path.join(cache_dir, os.path.basename(filename))
+    return base + ".npy", base + ".json"
+
+
+def save_cache(filename, cube, cache_dir=CACHE_DIR):
+    """stores the cube once as float32 grid and header with the source's stamp"""
+    os.makedirs(cache_dir, exist_ok=True)
+    npyname, jsonname = cache_paths(filename, cache_dir)
+    np.save(npyname, cube.data.astype(np.float32))
+    stat = os.stat(filename)
+    header = {
+        "source": os.path.abspath(filename),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "comments": cube.comments,
+        "origin": cube.origin.tolist(),
+        "counts": cube.counts.tolist(),
+        "axes": cube.axes.tolist(),
+        "atoms": cube.atoms.tolist(),
+        "mo_ids": cube.mo_ids,
+    }
+    # the header is written last, it marks the cache entry as complete
+    with open(jsonname, "w") as handle:
+        json.dump(header, handle)
+
+
+def load_cache(filename, cache_dir=CACHE_DIR, mmap_mode="r"):
+    """the memory-mapped cached cube, or None if it is missing or outdated"""
+    npyname, jsonname = cache_paths(filename, cache_dir)
+    try:
+        with open(jsonname) as handle:
+            header = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(filename)
+    if (header["size"], header["mtime"]) != (stat.st_size, stat.st_mtime):
+        return None
+    return Cube(
+        header["comments"],
+        np.array(header["origin"]),
+        np.array(header["counts"]),
+        np.array(header["axes"]),
+        np.array(header["atoms"]).reshape(-1, 5),
+        header["mo_ids"],
+        np.load(npyname, mmap_mode=mmap_mode),
+    )
+
+
+def load_cube(filename, cache_dir=CACHE_DIR):
+    """reads a cube through the binary cache, the text is only parsed once"""
+    cube = load_cache(filename, cache_dir)
+    if cube is None:
+        save_cache(filename, read_cube(filename), cache_dir)
+        cube = load_cache(filename, cache_dir)
+    return cube
+
+
+def write_header(handle, cube):
+    """writes the title lines, grid axes, atoms and MO numbers of a cube"""
+    natoms = len(cube.atoms)
+    handle.write(cube.comments[0] + "\n" + cube.comments[1] + "\n")
+    if cube.mo_ids is None:
+        handle.write("%5d %11.6f %11.6f %11.6f\n" % (natoms, *cube.origin))
+    else:
+        handle.write("%5d %11.6f %11.6f %11.6f\n" % (-natoms, *cube.origin))
+    for count, axis in zip(cube.counts, cube.axes):
+        handle.write("%5d %11.6f %11.6f %11.6f\n" % (count, *axis))
+    for atom in cube.atoms:
+        handle.write("%5d %11.6f %11.6f %11.6f %11.6f\n" % (int(atom[0]), *atom[1:]))
+    if cube.mo_ids is not None:
+        handle.write("".join("%5d" % x for x in [len(cube.mo_ids)] + cube.mo_ids) + "\n")
+
+
+def write_grid(handle, data):
+    """writes grid values, six per line and a new line for every z row
+
+    data can be the whole grid or a slab of it along x
+    """
+    rows = np.reshape(data, (data.shape[0] * data.shape[1], -1))
+    n = rows.shape[1]
+    row_fmt = "".join(
+        " %12.5E" + ("\n" if (k + 1) % 6 == 0 or k == n - 1 else "") for k in range(n)
+    )
+    for row in rows:
+        handle.write(row_fmt % tuple(row))
+
+
+def write_cube(filename, cube):
+    """writes a cube file"""
+    with open(filename, "w") as handle:
+        write_header(handle, cube)
+        write_grid(handle, cube.data)
+
+
+def downsample(cube, step):
+    """keeps every step-th point along each axis, like chimera's 'step'"""
+    if step <= 1:
+        return cube
+    data = cube.data[::step, ::step, ::step]
+    counts = np.sign(cube.counts) * np.array(data.shape[:3])
+    return cube._replace(counts=counts, axes=cube.axes * step, data=data)
+
+
+def crop(cube, level, margin=3):
+    """crops the grid to the box where |value| >= level plus a margin of points"""
+    mask = np.abs(cube.data) >= level
+    if mask.ndim > 3:
+        mask = mask.any(axis=3)
+    if not mask.any():
+        return cube
+    lo = []
+    hi = []
+    for axis in range(3):
+        others = tuple(k for k in range(3) if k != axis)
+        found = np.flatnonzero(mask.any(axis=others))
+        lo.append(max(found[0] - margin, 0))
+        hi.append(min(found[-1] + margin + 1, mask.shape[axis]))
+    data = cube.data[lo[0] : hi[0], lo[1] : hi[1], lo[2] : hi[2]]
+    origin = cube.origin + np.array(lo) @ cube.axes
+    counts = np.sign(cube.counts) * np.array(data.shape[:3])
+    return cube._replace(origin=origin, counts=counts, data=data)
+
+
+def same_grid(cube1, cube2):
+    """both cubes share origin, number of points and step vectors"""
+    return (
+        np.allclose(cube1.origin, cube2.origin)
+        and np.array_equal(cube1.counts, cube2.counts)
+        and np.allclose(cube1.axes, cube2.axes)
+    )
+
+
+def auto_isovalue(data, fraction=0.8, power=1, bins=4096, chunk=32):
+    """isovalue whose isosurface encloses a fraction of sum(|value|**power)
+
+    a cumulative histogram over log-spaced |value| bins, accumulated slab by
+    slab so memory-mapped grids are never loaded at once
+    """
+    slabs = [data[k : k + chunk] for k in range(0, len(data), chunk)]
+    vmax = max(float(np.abs(slab).max()) for slab in slabs)
+    if vmax == 0.0:
+        return 0.0
+    edges = np.logspace(np.log10(vmax) - 12, np.log10(vmax), bins + 1)
+    hist = np.zeros(bins)
+    total = 0.0
+    for slab in slabs:
+        values = np.abs(np.asarray(slab, dtype=float)).ravel()
+        weights = values**power
+        total += weights.sum()
+        hist += np.histogram(values, edges, weights=weights)[0]
+    # enclosed[k]: everything at or above the lower edge of bin k
+    enclosed = np.cumsum(hist[::-1])[::-1]
+    k = np.flatnonzero(enclosed >= fraction * total)
+    return float(edges[k[-1]]) if len(k) else float(edges[0])
+
+
+def slim_cube(filename, out_dir="slim", step=1, level=None, margin=3, cache_dir=None):
+    """writes a downsampled and/or cropped copy of a cube and returns its name"""
+    if cache_dir:
+        cube = load_cube(filename, cache_dir)
+    else:
+        cube = read_cube(filename)
+    if level is not None:
+        cube = crop(cube, level, margin)
+    cube = downsample(cube, step)
+    os.makedirs(out_dir, exist_ok=True)
+    slimname = os.path.join(out_dir, os.path.basename(filename))
+    write_cube(slimname, cube)
+    return slimname
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    if args.cache_only:
+        for filename in args.cubes:
+            load_cube(filename)
+            print(f"{filename} -> {cache_paths(filename)[0]}")
+        return
+
+    cache_dir = CACHE_DIR if args.cache else None
+    for filename in args.cubes:
+        slimname = slim_cube(
+            filename, args.out_dir, args.downsample, args.crop, args.margin, cache_dir
+        )
+        print(
+            f"{filename} ({os.path.getsize(filename)} bytes) -> "
+            f"{slimname} ({os.path.getsize(slimname)} bytes)"
+        )
+
+
+if __name__ == "__main__":
+    main()
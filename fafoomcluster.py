@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+""" clusters the structures of a converted fafoom backup by their RMSD after
+optimal superposition (Kabsch) and writes one representative per cluster
+
+needs the packed coordinates of Fafoom-backup2sdf.py --coordinates
+"""
+
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import timings
+
+# memory-mapped coordinates and the compared atoms of the worker processes,
+# set by load_coordinates
+COORDS = None
+ATOMS = None
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("RMSD clustering of the structures of a converted fafoom backup")
+    )
+    parser.add_argument(
+        "name",
+        nargs="?",
+        default="population",
+        help="population or blacklist, i.e. the name of the sdf file (default: population)",
+    )
+    parser.add_argument(
+        "--cutoff",
+        "-c",
+        default=1.0,
+        type=float,
+        help="RMSD in angstrom below which two structures are neighbours (default: 1.0)",
+    )
+    parser.add_argument(
+        "--tile",
+        "-t",
+        default=256,
+        type=int,
+        help="structures per side of a block of the pairwise RMSD matrix (default: 256)",
+    )
+    parser.add_argument(
+        "--heavy",
+        action="store_true",
+        help="only compare the heavy atoms",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="number of worker processes (default: all cores)",
+    )
+    timings.add_arguments(parser)
+
+    return parser.parse_args(args)
+
+
+def load_coordinates(name, heavy=False):
+    """maps the float32 coordinates, nothing is read until a block is needed
+
+    returns the memmap and the compared atoms (None for all of them)
+    """
+    global COORDS, ATOMS
+
+    COORDS = np.load(name + "_coords.npy", mmap_mode="r")
+    ATOMS = None
+    if heavy:
+        with open(name + "_elements.json") as handle:
+            elements = json.load(handle)
+        ATOMS = [k for k, element in enumerate(elements) if element != "H"]
+    return COORDS, ATOMS
+
+
+def coordinate_block(start, stop):
+    """the centered float64 coordinates of the structures start:stop
+
+    structures that are nan sit at the origin, so they don't spoil the blocks
+    """
+    block = np.asarray(COORDS[start:stop], dtype=float)
+    if ATOMS is not None:
+        block = block[:, ATOMS]
+    return np.nan_to_num(block - block.mean(axis=1, keepdims=True))
+
+
+def valid_structures(n, tile):
+    """which structures have coordinates, read tile by tile"""
+    valid = np.zeros(n, dtype=bool)
+    for start in range(0, n, tile):
+        block = COORDS[start : start + tile]
+        if ATOMS is not None:
+            block = block[:, ATOMS]
+        valid[start : start + tile] = ~np.isnan(block).any(axis=(1, 2))
+    return valid
+
+
+def kabsch_rmsd(first, second):
+    """RMSD after optimal superposition of all pairs of two centered blocks
+
+    first (n, atoms, 3), second (m, atoms, 3) -> (n, m)
+    """
+    # covariance matrices of all pairs and their singular values
+    covariance = np.einsum("iak,jal->ijkl", first, second)
+    singular = np.linalg.svd(covariance, compute_uv=False)
+    # a reflection would be no rotation, the smallest singular value flips sign then
+    singular[..., 2] *= np.sign(np.linalg.det(covariance))
+    squares = (first**2).sum(axis=(1, 2))[:, None] + (second**2).sum(axis=(1, 2))[None, :]
+    msd = (squares - 2 * singular.sum(axis=2)) / first.shape[1]
+    return np.sqrt(np.clip(msd, 0, None))
+
+
+def tile_neighbours(start_i, start_j, tile, cutoff):
+    """index pairs of one block of the RMSD matrix that are below the cutoff"""
+    first = coordinate_block(start_i, start_i + tile)
+    second = coordinate_block(start_j, start_j + tile)
+    rmsd = kabsch_rmsd(first, second)
+    i, j = np.nonzero(rmsd < cutoff)
+    i, j = i + start_i, j + start_j
+    # each pair once and no structure with itself
+    upper = i < j
+    return i[upper], j[upper]
+
+
+def neighbour_pairs(name, n, tile, cutoff, heavy=False, jobs=None):
+    """all pairs closer than the cutoff, only the upper triangle of blocks is computed"""
+    starts = range(0, n, tile)
+    blocks = [(i, j) for i in starts for j in starts if j >= i]
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=load_coordinates, initargs=(name, heavy)
+    ) as pool:
+        futures = [pool.submit(tile_neighbours, i, j, tile, cutoff) for i, j in blocks]
+        pairs = [future.result() for future in futures]
+    if not pairs:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return np.concatenate([p[0] for p in pairs]), np.concatenate([p[1] for p in pairs])
+
+
+def butina(n, first, second, valid):
+    """Butina clustering: the unassigned structure with the most neighbours
+    becomes a centroid and takes its unassigned neighbours into its cluster,
+    until all are assigned. cluster numbers (-1 for invalid ones), centroids"""
+    neighbours = [[] for _ in range(n)]
+    for i, j in zip(first.tolist(), second.tolist()):
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+    clusters = np.full(n, -1)
+    centroids = []
+    order = sorted(np.flatnonzero(valid), key=lambda k: -len(neighbours[k]))
+    for k in order:
+        if clusters[k] >= 0:
+            continue
+        clusters[k] = len(centroids)
+        for other in neighbours[k]:
+            if clusters[other] < 0:
+                clusters[other] = len(centroids)
+        centroids.append(k)
+    return clusters, centroids
+
+
+def sdf_blocks(sdfname):
+    with open(sdfname) as handle:
+        return [block + "$$$$\n" for block in handle.read().split("$$$$\n")[:-1]]
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    with timings.session(args):
+        with timings.stage("load"):
+            coords, _ = load_coordinates(args.name, args.heavy)
+            n = len(coords)
+            valid = valid_structures(n, args.tile)
+        if not valid.all():
+            print(f"{np.count_nonzero(~valid)} structures without coordinates are left out")
+        with timings.stage("rmsd"):
+            first, second = neighbour_pairs(
+                args.name, n, args.tile, args.cutoff, args.heavy, args.jobs
+            )
+            keep = valid[first] & valid[second]
+            first, second = first[keep], second[keep]
+        with timings.stage("butina"):
+            clusters, centroids = butina(n, first, second, valid)
+        with timings.stage("write"):
+            sizes = np.bincount(clusters[clusters >= 0], minlength=len(centroids))
+            with open(args.name + "_clusters.csv", "w") as handle:
+                handle.write("structure,cluster,representative\n")
+                for k, cluster in enumerate(clusters):
+                    representative = int(cluster >= 0 and centroids[cluster] == k)
+                    handle.write(f"{k},{cluster},{representative}\n")
+            blocks = sdf_blocks(args.name + ".sdf")
+            with open(args.name + "_representatives.sdf", "w") as handle:
+                for cluster, k in enumerate(centroids):
+                    block = blocks[k][: -len("$$$$\n")]
+                    handle.write(
+                        block + f"> <cluster>\n{cluster}\n\n> <cluster_size>\n{sizes[cluster]}\n\n$$$$\n"
+                    )
+        print(f"{n} structures, {len(centroids)} clusters with an RMSD cutoff of {args.cutoff} A")
+        print(f"representatives written to {args.name}_representatives.sdf")
+
+
+if __name__ == "__main__":
+    main()
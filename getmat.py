@@ -1,10 +1,21 @@
 #!/usr/bin/env python3
 """ script to extract the SOCMEs from an ORCA 5.0 output file """
 
+import io
+import os
+import re
 import sys
 import argparse as ap
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
+
+import timings
+
+# STATE  1:  E=   0.121012 au      3.293 eV    26559.3 cm**-1 <S**2> =   0.000000
+ORCA_STATE = re.compile(r"STATE\s+(\d+):\s+E=\s*\S+\s+au\s+(\S+)\s+eV")
+# figures of this process, cleared and drawn again for every molecule
+FIGURES = {}
 
 
 def get_input(args):
@@ -13,13 +24,36 @@ def get_input(args):
         description=("extract the spin-orbit-coupling matrix from orca 4.1")
     )
     parser.add_argument(
-        "orca_file", help=("orca 4 output file containing the SOC matrix")
+        "orca_file",
+        nargs="+",
+        help=(
+            "orca 4 output file containing the SOC matrix. with several files only "
+            "the heatmaps of their M_S matrices are rendered, in parallel"
+        ),
     )
     parser.add_argument(
         "--no-print",
         "-np",
         action="store_true",
-        help="does not show the matrix",
+        help="does not plot the matrix",
+    )
+    parser.add_argument(
+        "--plot-dir",
+        "-pd",
+        default=".",
+        help="directory of the <orca_file>.socme.png heatmaps (default: .)",
+    )
+    parser.add_argument(
+        "--bars",
+        "-b",
+        action="store_true",
+        help="also render the matrix as 3d bars to <orca_file>.socme3d.png",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="number of worker processes rendering several files (default: all cores)",
     )
     parser.add_argument(
         "--no-save",
@@ -42,8 +76,42 @@ def get_input(args):
         type=float,
         help="broadening of lorentz function for k_ISC",
     )
+    parser.add_argument(
+        "--reduced",
+        "-r",
+        action="store_true",
+        help=(
+            "also save the reduced singlet-triplet and triplet-triplet SOCMEs to "
+            "reduced-st-mat.csv and reduced-tt-mat.csv"
+        ),
+    )
+    parser.add_argument(
+        "--scan",
+        action="store_true",
+        help=(
+            "the output has many TDDFT steps (scan, multi xyz): writes the state energies "
+            "of every step to <prefix>_singlets.csv/_triplets.csv and the SOCMEs to "
+            "<prefix>_socme.npy, the file is read once line by line"
+        ),
+    )
+    parser.add_argument(
+        "--scan-prefix",
+        default="scan",
+        help="prefix of the --scan outputs (default: scan)",
+    )
+    timings.add_arguments(parser)
 
-    return parser.parse_args(args)
+    args = parser.parse_args(args)
+    if len(args.orca_file) > 1:
+        # several files are only rendered, nothing else would happen to them
+        single = [
+            "--" + dest.replace("_", "-")
+            for dest in ("no_print", "no_save", "matrix_file", "gamma", "reduced", "scan", "scan_prefix")
+            if getattr(args, dest) != parser.get_default(dest)
+        ]
+        if single:
+            parser.error(f"{', '.join(single)} only work with a single orca_file")
+    return args
 
 
 def get_lines(filename):
@@ -62,180 +130,208 @@ def get_number_of_excited_states(raw):
             return int(sline[-1])
 
 
-def euc_dist(array):
-    return np.sqrt(np.sum(np.power(np.abs(array), 2)))
-
-
-def get_socme(raw):
-    line_counter = 0
-    n_exc_found = False
-    xyz_found = False
-    ms_found = False
-
+def get_socme_blocks(raw):
+    """all SOCME blocks of an ORCA output in one pass over the lines
+
+    returns a dict of matrices, rows=singlets/triplets columns=triplets:
+    st_xyz and st_ms   |SOCME| of the xyz and the M_S block (n_exc + 1, n_exc)
+    st_reduced         reduced singlet-triplet SOCMEs (n_exc + 1, n_exc)
+    tt_reduced         reduced triplet-triplet SOCMEs (n_exc, n_exc), symmetric
+    blocks that aren't in the output stay zero, "found" lists the others
+    """
+    #      --------------------------------------------------------------------------------
+    #                      CALCULATED SOCME BETWEEN TRIPLETS AND SINGLETS
+    #      --------------------------------------------------------------------------------
+    #           Root                          <T|HSO|S>  (Re, Im) cm-1
+    #         T      S              Z                    X                     Y           < FIRST OCCURRENCE IS XYZ
+    #         T      S           MS= 0                  -1                    +1           < SECOND IS M_S
+    #      --------------------------------------------------------------------------------
+    #         1      0    (0.00e+00 , 8.41e+00)    (-6.17e+00 , -4.88e+00)    (-6.17e+00 , 4.88e+00)
+    #
+    # the reduced blocks have real x y z columns and count the triplets from 0
     print("searching for SOCME matrix")
-    for line in raw:
-        if "Number of roots to be determined" in line and n_exc_found == False:
-            n_exc_found = True
-            sline = line.split()
-            n_exc = int(sline[-1])
-            sing_trip_xyz = np.zeros((n_exc, n_exc + 1))
-            sing_trip_ms = np.zeros((n_exc, n_exc + 1))
-
-        #      --------------------------------------------------------------------------------
-        #                      CALCULATED SOCME BETWEEN TRIPLETS AND SINGLETS
-        #      --------------------------------------------------------------------------------
-        #           Root                          <T|HSO|S>  (Re, Im) cm-1
-        #         T      S              Z                    X                     Y           < FIRST OCCURRENCE IS XYZ
-        #         T      S           MS= 0                  -1                    +1           < SECOND IS M_S
-        #      --------------------------------------------------------------------------------
-        #         1      0    (0.00e+00 , 8.41e+00)    (-6.17e+00 , -4.88e+00)    (-6.17e+00 , 4.88e+00)
-
-        if (
-            "CALCULATED SOCME BETWEEN TRIPLETS AND SINGLETS" in line
-            and n_exc_found == True
-            and xyz_found == False
-        ):
-            print(f"found xyz line of socme in line {line_counter}")
-            xyz_line_count = line_counter
-            xyz_found = True
-            # [1, 0] to [100, 100]
-            rows = raw[
-                line_counter + 5 : line_counter + n_exc * (n_exc + 1) + 5
-            ]
-            for row in rows:
-                row = row.replace("(", " ").replace(")", " ").replace(",", " ")
-                #  1      0    0.00e+00  8.41e+00    -6.17e+00   -4.88e+00    -6.17e+00   4.88e+00
-                srow = row.split()
-                i, j, r1, i1, r2, i2, r3, i3 = srow
-                i, j, r1, i1, r2, i2, r3, i3 = (
-                    int(i),
-                    int(j),
-                    float(r1),
-                    float(i1),
-                    float(r2),
-                    float(i2),
-                    float(r3),
-                    float(i3),
-                )
-                socme = np.array(
-                    [complex(r1, i1), complex(r2, i2), complex(r3, i3)]
-                )
-                socme = euc_dist(socme)
-                sing_trip_xyz[i - 1, j] = socme
-
-        if (
-            "CALCULATED SOCME BETWEEN TRIPLETS AND SINGLETS" in line
-            and n_exc_found == True
-            and xyz_found == True
-            and ms_found == False
-            and line_counter > xyz_line_count
-        ):
-            print(f"found m_s line of socme in line {line_counter}")
-            ms_found = True
-            # [1, 0] to [100, 100]
-            rows = raw[
-                line_counter + 5 : line_counter + n_exc * (n_exc + 1) + 5
-            ]
-            for row in rows:
-                row = row.replace("(", " ").replace(")", " ").replace(",", " ")
-                #  1      0    0.00e+00  8.41e+00    -6.17e+00   -4.88e+00    -6.17e+00   4.88e+00
-                srow = row.split()
-                i, j, r1, i1, r2, i2, r3, i3 = srow
-                i, j, r1, i1, r2, i2, r3, i3 = (
-                    int(i),
-                    int(j),
-                    float(r1),
-                    float(i1),
-                    float(r2),
-                    float(i2),
-                    float(r3),
-                    float(i3),
-                )
-                socme = np.array(
-                    [complex(r1, i1), complex(r2, i2), complex(r3, i3)]
-                )
-                socme = euc_dist(socme)
-                sing_trip_ms[i - 1, j] = socme
-
-        line_counter += 1
-
-    return sing_trip_xyz.T, sing_trip_ms.T
-
-
-# haven't tried this in a while
-def get_reduced_socme(raw):
+    blocks = {"found": []}
+    n_exc = None
     line_counter = 0
-    n_exc_found = False
-    sing_trip_found = False
-    trip_trip_found = False
-
-    for line in raw:
-        if "Number of roots to be determined" in line and n_exc_found == False:
-            n_exc_found = True
-            sline = line.split()
-            n_exc = int(sline[-1])
-            sing_trip_mat = np.zeros((n_exc, n_exc + 1))
-            trip_trip_mat = np.zeros((n_exc, n_exc))
-
-        if (
-            "CALCULATED REDUCED SOCME BETWEEN TRIPLETS AND SINGLETS" in line
-            and n_exc_found == True
-            and sing_trip_found == False
-        ):
-            sing_trip_found = True
-            # [0, 0] bis [n_exc-1, n_exc]
-            rows = raw[
-                line_counter + 5 : line_counter + n_exc * (n_exc + 1) + 5
-            ]
-            for row in rows:
-                srow = row.split()
-                i, j, x, y, z = srow
-                i, j, x, y, z = int(i), int(j), float(x), float(y), float(z)
-                socme = np.array([x, y, z])
-                socme = euc_dist(socme)
-                sing_trip_mat[i, j] = socme
-
-        if (
-            "CALCULATED REDUCED SOCME BETWEEN TRIPLETS" in line
-            and not "SINGLETS" in line
-            and n_exc_found == True
-            and sing_trip_found == True
-            and trip_trip_found == False
-        ):
-            trip_trip_found == True
-            # [0, 0] bis [nexc-1, nexc-1]
-            rows = raw[
-                line_counter + 5 : line_counter + n_exc * (n_exc + 1) // 2 + 5
-            ]
-            for row in rows:
-                srow = row.split()
-                i, j, x, y, z = srow
-                i, j, x, y, z = int(i), int(j), float(x), float(y), float(z)
-                socme = np.array([x, y, z])
-                socme = euc_dist(socme)
-                trip_trip_mat[i, j] = socme
-            break
-
+    while line_counter < len(raw):
+        line = raw[line_counter]
+        if n_exc is None and "Number of roots to be determined" in line:
+            n_exc = int(line.split()[-1])
+            blocks["st_xyz"] = np.zeros((n_exc + 1, n_exc))
+            blocks["st_ms"] = np.zeros((n_exc + 1, n_exc))
+            blocks["st_reduced"] = np.zeros((n_exc + 1, n_exc))
+            blocks["tt_reduced"] = np.zeros((n_exc, n_exc))
+        elif n_exc is not None and "SOCME BETWEEN TRIPLETS" in line:
+            if "REDUCED" not in line and "SINGLETS" in line:
+                key = "st_ms" if "st_xyz" in blocks["found"] else "st_xyz"
+                n_rows, first_row = n_exc * (n_exc + 1), 1
+            elif "REDUCED" in line and "SINGLETS" in line:
+                key, n_rows, first_row = "st_reduced", n_exc * (n_exc + 1), 0
+            elif "REDUCED" in line:
+                key, n_rows, first_row = "tt_reduced", n_exc * (n_exc + 1) // 2, 0
+            else:
+                key = None
+            if key is not None and key not in blocks["found"]:
+                print(f"found {key} block of socme in line {line_counter}")
+                rows = raw[line_counter + 5 : line_counter + n_rows + 5]
+                shape = (n_exc, n_exc) if key == "tt_reduced" else (n_exc, n_exc + 1)
+                matrix = socme_rows_to_matrix(rows, shape, first_row)
+                if key == "tt_reduced":
+                    # only one triangle is printed
+                    matrix = np.maximum(matrix, matrix.T)
+                blocks[key] = matrix.T
+                blocks["found"].append(key)
+                # the rows are done, no need to look at them again
+                line_counter += n_rows + 4
         line_counter += 1
 
-    return sing_trip_mat.T, trip_trip_mat.T
+    return blocks
 
 
-def print_mat(mat):
-    plt.imshow(mat, interpolation=None, cmap="Greys")
-    plt.xticks(np.arange(9, 101, 10), np.arange(10, 101, 10))
-    cbar = plt.colorbar()
-    plt.show()
+def get_socme(raw):
+    blocks = get_socme_blocks(raw)
+    return blocks["st_xyz"], blocks["st_ms"]
 
 
-def print_3dmat(mat):
+def get_reduced_socme(raw):
+    blocks = get_socme_blocks(raw)
+    return blocks["st_reduced"], blocks["tt_reduced"]
+
+
+def socme_rows_to_matrix(rows, shape, first_row=1):
+    """|SOCME| of the rows of an ORCA SOCME block as matrix of the given shape
+
+    rows look like '  1      0    (0.00e+00 , 8.41e+00)    (-6.17e+00 , -4.88e+00) ...'
+    with complex or real components, first_row is the number of the first
+    root of the block (1 for the triplets of the SOCME blocks)
+    """
+    text = " ".join(rows).replace("(", " ").replace(")", " ").replace(",", " ")
+    values = np.array(text.split(), dtype=float).reshape(len(rows), -1)
+    matrix = np.zeros(shape)
+    i, j = values[:, 0].astype(int) - first_row, values[:, 1].astype(int)
+    matrix[i, j] = np.sqrt(np.sum(values[:, 2:] ** 2, axis=1))
+    return matrix
+
+
+def iter_scan_steps(filename):
+    """walks an ORCA output with many TDDFT steps once, line by line, and yields
+    a dict per step with the singlet and triplet excitation energies in eV and
+    the SOCME matrices st_xyz and st_ms (rows=singlets, columns=triplets, like
+    get_socme) if they were calculated
+
+    a step starts with every singlet (or unrestricted) excited states section,
+    so a relaxed scan gives one step per TDDFT calculation, not per scan point
+    """
+    step = None
+    section = None
+    socme_blocks = []
+    with open(filename, "r") as handle:
+        for line in handle:
+            if "EXCITED STATES" in line and "SOC" not in line:
+                if "(TRIPLETS)" in line:
+                    section = "triplets"
+                    continue
+                if step is not None:
+                    yield finish_step(step, socme_blocks)
+                step = {"singlets": [], "triplets": []}
+                socme_blocks = []
+                section = "singlets"
+            elif "CALCULATED SOCME BETWEEN TRIPLETS AND SINGLETS" in line and step is not None:
+                # 4 header lines, then the rows until the first line that isn't one
+                for _ in range(4):
+                    next(handle)
+                rows = []
+                for row in handle:
+                    if not row.split() or not row.split()[0].isdigit():
+                        break
+                    rows.append(row)
+                socme_blocks.append(rows)
+                section = None
+            elif section is not None:
+                match = ORCA_STATE.search(line)
+                if match:
+                    step[section].append(float(match.group(2)))
+    if step is not None:
+        yield finish_step(step, socme_blocks)
+
+
+def finish_step(step, socme_blocks):
+    singlets = np.array(step["singlets"])
+    triplets = np.array(step["triplets"])
+    result = {"singlets": singlets, "triplets": triplets, "st_xyz": None, "st_ms": None}
+    n_exc = len(triplets)
+    for key, rows in zip(("st_xyz", "st_ms"), socme_blocks):
+        result[key] = socme_rows_to_matrix(rows, (n_exc, n_exc + 1)).T
+    return result
+
+
+def collect_scan(filename):
+    """the steps of iter_scan_steps stacked into (n_steps, n_states) arrays,
+    steps with fewer states are padded with nan, and the SOCMEs into
+    (n_steps, n_states + 1, n_states) or None"""
+    singlets, triplets, socmes = [], [], []
+    for step in iter_scan_steps(filename):
+        singlets.append(step["singlets"])
+        triplets.append(step["triplets"])
+        socmes.append(step["st_ms"])
+
+    def stack(rows):
+        width = max([len(row) for row in rows] + [0])
+        array = np.full((len(rows), width), np.nan)
+        for k, row in enumerate(rows):
+            array[k, : len(row)] = row
+        return array
+
+    socme = None
+    if socmes and all(m is not None and m.shape == socmes[0].shape for m in socmes):
+        socme = np.stack(socmes)
+    return stack(singlets), stack(triplets), socme
+
+
+def get_figure(kind, figsize):
+    """an empty figure of this process, rendered without a display by Agg"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    if kind not in FIGURES:
+        FIGURES[kind] = Figure(figsize=figsize)
+        FigureCanvasAgg(FIGURES[kind])
+    fig = FIGURES[kind]
+    fig.clf()
+    return fig
+
+
+def ticks(n, first=0):
+    """about ten ticks for n rows or columns numbered from first"""
+    step = max(1, int(np.ceil(n / 10)))
+    labels = np.arange(max(step, first), n + first, step)
+    return labels - first, labels
+
+
+def print_mat(mat, filename, title=None):
+    """heatmap of a matrix, rows=singlets from S0 columns=triplets from T1"""
+    fig = get_figure("heatmap", (8, 3.5))
+    ax = fig.add_subplot(111)
+    image = ax.imshow(mat, interpolation="nearest", cmap="Greys", aspect="auto")
+    ax.set_xticks(*ticks(mat.shape[1], first=1))
+    ax.set_yticks(*ticks(mat.shape[0]))
+    ax.set_xlabel("T")
+    ax.set_ylabel("S")
+    if title:
+        ax.set_title(title)
+    fig.colorbar(image, ax=ax, label="|SOCME| / cm$^{-1}$")
+    fig.tight_layout()
+    fig.savefig(filename, dpi=150)
+
+
+def print_3dmat(mat, filename, title=None):
     from mpl_toolkits.mplot3d import Axes3D
 
-    fig = plt.figure(figsize=(8, 3))
+    fig = get_figure("bars", (8, 3))
     ax = fig.add_subplot(111, projection="3d")
 
-    _x = np.arange(100)
-    _y = np.arange(101)
+    _x = np.arange(mat.shape[1])
+    _y = np.arange(mat.shape[0])
     _xx, _yy = np.meshgrid(_x, _y)
     x, y = _xx.ravel(), _yy.ravel()
 
@@ -244,8 +340,44 @@ def print_3dmat(mat):
     width = depth = 1
 
     ax.bar3d(x, y, bottom, width, depth, top, shade=True)
-
-    plt.show()
+    if title:
+        ax.set_title(title)
+
+    fig.savefig(filename, dpi=150)
+
+
+def plot_names(orca_file, plot_dir):
+    name = os.path.join(plot_dir, os.path.basename(orca_file))
+    return name + ".socme.png", name + ".socme3d.png"
+
+
+def render(orca_file, plot_dir=".", bars=False):
+    """heatmap (and bars) of the M_S matrix of one ORCA output, for render_many"""
+    with redirect_stdout(io.StringIO()):
+        st_ms_mat = get_socme(get_lines(orca_file))[1]
+    heatmap, bars_name = plot_names(orca_file, plot_dir)
+    print_mat(st_ms_mat, heatmap, os.path.basename(orca_file))
+    if bars:
+        print_3dmat(st_ms_mat, bars_name, os.path.basename(orca_file))
+    return heatmap
+
+
+def render_many(orca_files, plot_dir=".", bars=False, jobs=None):
+    """renders a whole screening set, every worker keeps its figures for all
+    the molecules it gets"""
+    os.makedirs(plot_dir, exist_ok=True)
+    n = len(orca_files)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        chunksize = max(1, n // (4 * (jobs or os.cpu_count() or 1)))
+        heatmaps = pool.map(
+            render,
+            orca_files,
+            [plot_dir] * n,
+            [bars] * n,
+            chunksize=chunksize,
+        )
+        for orca_file, heatmap in zip(orca_files, heatmaps):
+            print(f"{orca_file} -> {heatmap}")
 
 
 def save_mat(mat, filename):
@@ -339,23 +471,63 @@ def calc_kISC(singlets, triplets, couplings, gamma):
 def main():
     args = get_input(sys.argv[1:])
 
-    file_data = get_lines(args.orca_file)
-
-    total_energy = get_total_energy(file_data)
-    singlets, triplets = get_orca_excited_states(file_data)
-
-    st_xyz_mat, st_ms_mat = get_socme(file_data)
-
-    calc_kISC(singlets, triplets, st_xyz_mat, args.gamma)
-
-    if not args.no_print:
-        print_mat(st_ms_mat)
-
-    if not args.no_save:
-        save_mat(st_ms_mat, args.matrix_file)
-        save_mat(st_xyz_mat, "xyz_matrix.csv")
-        with open("xyz_matrix.csv", "a") as handle:
-            handle.write("Top to Bottom: Singlets, Left to Right: Triplets")
+    with timings.session(args):
+        if len(args.orca_file) > 1:
+            with timings.stage("render_many"):
+                render_many(args.orca_file, args.plot_dir, args.bars, args.jobs)
+            return
+        args.orca_file = args.orca_file[0]
+
+        if args.scan:
+            with timings.stage("collect_scan"):
+                singlets, triplets, socme = collect_scan(args.orca_file)
+            print(f"{len(singlets)} TDDFT steps with {singlets.shape[1]} singlets and {triplets.shape[1]} triplets")
+            with timings.stage("save"):
+                np.savetxt(f"{args.scan_prefix}_singlets.csv", singlets, delimiter=",", fmt="%.4f")
+                np.savetxt(f"{args.scan_prefix}_triplets.csv", triplets, delimiter=",", fmt="%.4f")
+                if socme is not None:
+                    np.save(f"{args.scan_prefix}_socme.npy", socme)
+            return
+
+        with timings.stage("get_lines"):
+            file_data = get_lines(args.orca_file)
+
+        with timings.stage("get_total_energy"):
+            total_energy = get_total_energy(file_data)
+        with timings.stage("get_orca_excited_states"):
+            singlets, triplets = get_orca_excited_states(file_data)
+
+        with timings.stage("get_socme_blocks"):
+            blocks = get_socme_blocks(file_data)
+            st_xyz_mat, st_ms_mat = blocks["st_xyz"], blocks["st_ms"]
+
+        with timings.stage("calc_kISC"):
+            calc_kISC(singlets, triplets, st_xyz_mat, args.gamma)
+
+        if not args.no_print:
+            with timings.stage("print_mat"):
+                os.makedirs(args.plot_dir, exist_ok=True)
+                heatmap, bars_name = plot_names(args.orca_file, args.plot_dir)
+                print_mat(st_ms_mat, heatmap)
+                if args.bars:
+                    print_3dmat(st_ms_mat, bars_name)
+                print(f"heatmap written to {heatmap}")
+
+        if not args.no_save:
+            with timings.stage("save_mat"):
+                save_mat(st_ms_mat, args.matrix_file)
+                save_mat(st_xyz_mat, "xyz_matrix.csv")
+                with open("xyz_matrix.csv", "a") as handle:
+                    handle.write("Top to Bottom: Singlets, Left to Right: Triplets")
+                if args.reduced:
+                    for key, filename in (
+                        ("st_reduced", "reduced-st-mat.csv"),
+                        ("tt_reduced", "reduced-tt-mat.csv"),
+                    ):
+                        if key in blocks["found"]:
+                            save_mat(blocks[key], filename)
+                        else:
+                            print(f"no {key} block in {args.orca_file}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+""" hole-electron descriptors of excited states from Multiwfn's hole and
+electron cubes: centroid distance D, overlap Sr, extents and H and t index
+(definitions as in Multiwfn's hole-electron analysis, Carbon 2020, 165, 461) """
+
+import os
+import re
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from cubetools import read_cube, load_cube, same_grid, CACHE_DIR
+
+BOHR_TO_ANGSTROM = 0.529177210903
+# the columns of the descriptor table, lengths in angstrom
+COLUMNS = ["D", "Sr", "sigma_h", "sigma_e", "H", "t"]
+# electron000001.cub, the state number of Multiwfn's electron cubes
+CUBE_NAME = re.compile(r"^electron(\d+)\.cub$")
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("hole-electron descriptors from hole and electron cubes")
+    )
+    parser.add_argument(
+        "states",
+        nargs="*",
+        type=int,
+        help="state numbers of hole000001.cub/electron000001.cub like pairs "
+        "(default: all electron cubes found)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=os.cpu_count(),
+        type=int,
+        help="number of states processed in parallel (default: all cores)",
+    )
+    parser.add_argument(
+        "--chunk",
+        "-c",
+        default=16,
+        type=int,
+        help="number of grid planes held in memory at once (default: 16)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"parse the text cubes instead of memory-mapping their copies in {CACHE_DIR}/",
+    )
+    parser.add_argument(
+        "--out",
+        "-o",
+        default="descriptors.csv",
+        help="csv file for the descriptors (default: descriptors.csv)",
+    )
+
+    return parser.parse_args(args)
+
+
+def cube_names(nr):
+    """Multiwfn's names of the hole and electron cubes of a state"""
+    return f"hole{nr:06}.cub", f"electron{nr:06}.cub"
+
+
+def grid_points(cube, start, stop):
+    """cartesian coordinates (bohr) of the grid planes start:stop along x"""
+    nx, ny, nz = cube.data.shape[:3]
+    i = np.arange(start, min(stop, nx))[:, None, None, None]
+    j = np.arange(ny)[None, :, None, None]
+    k = np.arange(nz)[None, None, :, None]
+    return cube.origin + i * cube.axes[0] + j * cube.axes[1] + k * cube.axes[2]
+
+
+def descriptors(hole, electron, chunk=16, cache=True):
+    """hole-electron descriptors of one state, accumulated plane by plane"""
+    if cache:
+        hol, ele = load_cube(hole), load_cube(electron)
+    else:
+        hol, ele = read_cube(hole), read_cube(electron)
+    if not same_grid(hol, ele):
+        raise ValueError(f"{hole} and {electron} are not on the same grid")
+
+    # zeroth, first and second moments of both densities and the overlap
+    norm = np.zeros(2)
+    first = np.zeros((2, 3))
+    second = np.zeros((2, 3))
+    overlap = 0.0
+    for start in range(0, len(hol.data), chunk):
+        points = grid_points(hol, start, start + chunk)
+        rho_h = np.clip(np.asarray(hol.data[start : start + chunk], dtype=float), 0, None)
+        rho_e = np.clip(np.asarray(ele.data[start : start + chunk], dtype=float), 0, None)
+        for n, rho in enumerate((rho_h, rho_e)):
+            norm[n] += rho.sum()
+            first[n] += np.tensordot(rho, points, axes=3)
+            second[n] += np.tensordot(rho, points**2, axes=3)
+        overlap += np.sqrt(rho_h * rho_e).sum()
+
+    volume = abs(np.linalg.det(hol.axes))
+    centroid = first / norm[:, None]
+    sigma = np.sqrt(np.clip(second / norm[:, None] - centroid**2, 0, None))
+    # Multiwfn's H vector is the mean extent of hole and electron
+    h_vector = (sigma[0] + sigma[1]) / 2
+    distance = centroid[1] - centroid[0]
+    d = np.linalg.norm(distance)
+    h_ct = abs(h_vector @ distance) / d if d > 0 else 0.0
+    return {
+        "D": d * BOHR_TO_ANGSTROM,
+        "Sr": overlap * volume,
+        "sigma_h": np.linalg.norm(sigma[0]) * BOHR_TO_ANGSTROM,
+        "sigma_e": np.linalg.norm(sigma[1]) * BOHR_TO_ANGSTROM,
+        "H": np.linalg.norm(h_vector) * BOHR_TO_ANGSTROM,
+        "t": (d - h_ct) * BOHR_TO_ANGSTROM,
+    }
+
+
+def state_descriptors(states, jobs=None, chunk=16, cache=True):
+    """descriptors for all states whose hole and electron cubes exist"""
+    found = [nr for nr in states if all(os.path.exists(f) for f in cube_names(nr))]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            pool.submit(descriptors, *cube_names(nr), chunk, cache) for nr in found
+        ]
+        return {nr: future.result() for nr, future in zip(found, futures)}
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    matches = [CUBE_NAME.match(name) for name in glob.glob("electron[0-9]*.cub")]
+    states = args.states or sorted(int(match.group(1)) for match in matches if match)
+    results = state_descriptors(states, args.jobs, args.chunk, not args.no_cache)
+
+    with open(args.out, "w") as handle:
+        handle.write(",".join(["state"] + COLUMNS) + "\n")
+        for nr, result in results.items():
+            handle.write(",".join([str(nr)] + [f"{result[c]:.4f}" for c in COLUMNS]) + "\n")
+            print(f"{nr:4d} " + " ".join(f"{c}={result[c]:7.3f}" for c in COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+""" offscreen isosurface images of cube files without chimera: marching cubes
+on the grid, the molecule from the cube's atoms and matplotlib's Agg canvas """
+
+import os
+import io
+import sys
+import time
+import argparse
+import numpy as np
+
+from cubetools import read_cube, load_cube, CACHE_DIR
+
+# CPK like colors and covalent radii in angstrom, everything else is pink
+ELEMENTS = {
+    1: ("H", (0.9, 0.9, 0.9), 0.31),
+    5: ("B", (1.0, 0.71, 0.71), 0.84),
+    6: ("C", (0.56, 0.56, 0.56), 0.76),
+    7: ("N", (0.19, 0.31, 0.97), 0.71),
+    8: ("O", (1.0, 0.05, 0.05), 0.66),
+    9: ("F", (0.56, 0.88, 0.31), 0.57),
+    14: ("Si", (0.94, 0.78, 0.63), 1.11),
+    15: ("P", (1.0, 0.5, 0.0), 1.07),
+    16: ("S", (1.0, 1.0, 0.19), 1.05),
+    17: ("Cl", (0.12, 0.94, 0.12), 1.02),
+    35: ("Br", (0.65, 0.16, 0.16), 1.2),
+    53: ("I", (0.58, 0.0, 0.58), 1.39),
+}
+OTHER = ("X", (1.0, 0.08, 0.58), 1.4)
+BOHR_TO_ANGSTROM = 0.529177210903
+# image width units of chimera's copy command in inches
+UNITS = {"inches": 1.0, "centimeters": 1 / 2.54, "millimeters": 1 / 25.4, "points": 1 / 72}
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("render isosurface images of cube files without chimera")
+    )
+    parser.add_argument("cubes", nargs="+", help="*.cub or *.cube files")
+    parser.add_argument("--level", "-l", default="0.04", help="isovalue, default 0.04")
+    parser.add_argument(
+        "--plus", default=".9,.7,.1", help="RGB of the positive isosurface"
+    )
+    parser.add_argument(
+        "--minus", default="0,.5,.6", help="RGB of the negative isosurface"
+    )
+    parser.add_argument(
+        "--filetype", "-f", default="png", help="default png, jpeg possible"
+    )
+    parser.add_argument(
+        "--dpi", "-d", default="300", help="DPI value, default 300"
+    )
+    parser.add_argument(
+        "--width", "-w", default="2.6", help="image width, default 2.6"
+    )
+    parser.add_argument(
+        "--units", "-unit", default="centimeters", help="default centimeters"
+    )
+    parser.add_argument(
+        "--supersampling", "-ss", default="2", help="supersampling, default 2"
+    )
+    parser.add_argument(
+        "--cube-cache",
+        action="store_true",
+        help="keep binary copies of the cubes in cubecache/ so the text is only parsed once",
+    )
+
+    return parser.parse_args(args)
+
+
+def rgb(text):
+    """'0,0.8,1' -> (0.0, 0.8, 1.0)"""
+    return tuple(float(x) for x in text.split(","))
+
+
+def image_size(job):
+    """width and height in inches and the dpi of a job"""
+    dpi = float(job["dpi"])
+    if job.get("units"):
+        width = float(job["width"]) * UNITS[job["units"]]
+    else:
+        # without units chimera takes pixels
+        width = float(job["width"]) / dpi
+    if job.get("height"):
+        height = width * float(job["height"]) / float(job["width"])
+    else:
+        height = width * 0.75
+    return width, height, dpi
+
+
+def molecule_frame(atoms):
+    """center and principal axes of the atoms, the view looks along the smallest one"""
+    xyz = atoms[:, 2:5]
+    center = xyz.mean(axis=0)
+    if len(xyz) < 3:
+        return center, np.eye(3)
+    _, _, rotation = np.linalg.svd(xyz - center)
+    return center, rotation.T
+
+
+def bonds(xyz, numbers):
+    """atom pairs closer than 1.2 times the sum of their covalent radii"""
+    radii = np.array([ELEMENTS.get(int(z), OTHER)[2] for z in numbers]) / BOHR_TO_ANGSTROM
+    distance = np.linalg.norm(xyz[:, None] - xyz[None, :], axis=2)
+    i, j = np.nonzero(np.triu(distance < 1.2 * (radii[:, None] + radii[None, :]), k=1))
+    return list(zip(i, j))
+
+
+def draw(job, cube):
+    """the supersampled png of one job in a buffer and its dpi"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+    width, height, dpi = image_size(job)
+    supsam = int(job.get("supsam") or 1)
+    fig = Figure(figsize=(width, height), dpi=dpi * supsam)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1], projection="3d")
+    ax.set_axis_off()
+    ax.patch.set_alpha(0)
+    transparent = job.get("bgcolor", "none") == "none"
+    fig.patch.set_alpha(0 if transparent else 1)
+    if not transparent:
+        fig.patch.set_facecolor(job["bgcolor"])
+
+    center, rotation = molecule_frame(cube.atoms)
+    xyz = (cube.atoms[:, 2:5] - center) @ rotation
+    corners = [xyz]
+
+    # the isosurfaces, the minus color for the negative level like chimera's volume
+    if job.get("kind") != "geometry":
+        from skimage.measure import marching_cubes
+
+        level = float(job["level"])
+        data = cube.data if cube.data.ndim == 3 else cube.data[..., 0]
+        data = np.asarray(data, dtype=np.float32)
+        for sign, color in ((1, job["plus"]), (-1, job["minus"])):
+            if (sign * data).max() <= level:
+                continue
+            verts, faces, _, _ = marching_cubes(sign * data, level)
+            verts = (cube.origin + verts @ cube.axes - center) @ rotation
+            corners.append(verts)
+            ax.add_collection3d(
+                Poly3DCollection(
+                    verts[faces],
+                    facecolors=[rgb(color)],
+                    edgecolors=[rgb(color)],
+                    linewidths=0,
+                    shade=True,
+                )
+            )
+
+    # ball and stick molecule
+    numbers = cube.atoms[:, 0]
+    for i, j in bonds(cube.atoms[:, 2:5], numbers):
+        ax.plot(*xyz[[i, j]].T, color=(0.4, 0.4, 0.4), linewidth=1.5)
+
+    points = np.concatenate(corners)
+    lo, hi = points.min(axis=0), points.max(axis=0)
+    mid = (lo + hi) / 2
+    half = max((hi - lo)[0] / 2, (hi - lo)[1] / 2 * width / height, 1.0) * 1.05
+    ax.set_xlim(mid[0] - half, mid[0] + half)
+    ax.set_ylim(mid[1] - half * height / width, mid[1] + half * height / width)
+    ax.set_zlim(lo[2], hi[2])
+    ax.set_box_aspect((width, height, max(hi[2] - lo[2], 1e-3) / (2 * half) * width))
+    ax.view_init(elev=90, azim=-90)
+
+    # balls of 0.4 covalent radii in data units, marker sizes are in points so
+    # they don't change with the dpi, only with the zoom
+    points_per_bohr = width * 72 / (2 * half)
+    colors = [ELEMENTS.get(int(z), OTHER)[1] for z in numbers]
+    radii = np.array([ELEMENTS.get(int(z), OTHER)[2] for z in numbers]) * 0.4 / BOHR_TO_ANGSTROM
+    sizes = (2 * radii * points_per_bohr) ** 2
+    ax.scatter(*xyz.T, c=colors, s=sizes, depthshade=False, edgecolors="none")
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi * supsam, transparent=transparent)
+    return buffer, dpi
+
+
+def save(buffer, output, dpi, supsam):
+    """downsample the supersampled image and write it"""
+    from PIL import Image
+
+    buffer.seek(0)
+    with Image.open(buffer) as picture:
+        size = (max(1, picture.width // supsam), max(1, picture.height // supsam))
+        picture = picture.resize(size, Image.LANCZOS)
+        if output.endswith((".jpg", ".jpeg")):
+            flat = Image.new("RGB", picture.size, "white")
+            flat.paste(picture, mask=picture.getchannel("A"))
+            picture = flat
+        picture.save(output, dpi=(dpi, dpi))
+
+
+def render_job(job, cwd="."):
+    """renders one CDDToPic job, returns start, end and status for the render log"""
+    start = time.time()
+    try:
+        # job["cache"] reads the cube through cubecache/ of the job's directory
+        name = os.path.join(cwd, job["name"])
+        if job.get("cache"):
+            cube = load_cube(name, os.path.join(cwd, CACHE_DIR))
+        else:
+            cube = read_cube(name)
+        buffer, dpi = draw(job, cube)
+        save(buffer, os.path.join(cwd, job["output"]), dpi, int(job.get("supsam") or 1))
+        status = "ok"
+    except Exception as error:
+        print(f"{os.path.join(cwd, job['name'])}: {error}")
+        status = "failed"
+    return start, time.time(), status
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    for name in args.cubes:
+        job = {
+            "name": name,
+            "output": os.path.splitext(name)[0] + "." + args.filetype,
+            "level": args.level,
+            "plus": args.plus,
+            "minus": args.minus,
+            "dpi": args.dpi,
+            "width": args.width,
+            "units": args.units,
+            "supsam": args.supersampling,
+            "bgcolor": "none",
+            "cache": args.cube_cache,
+        }
+        start, end, status = render_job(job)
+        print(f"{job['output']}: {status} in {end - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
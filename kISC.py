@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 
 import sys
+import json
 import argparse
 import numpy as np
 
+import timings
+
 
 def getinput(args):
     """parse the input"""
@@ -38,11 +41,41 @@ def getinput(args):
         type=float,
         help=("Half life in inverse centimeters ... default 1000 cm^-1"),
     )
+    parser.add_argument(
+        "--singlet-file",
+        "-sf",
+        help=("Singlet energies in atomic units from a .npy or .csv file."),
+    )
+    parser.add_argument(
+        "--triplet-file",
+        "-tf",
+        help=("Triplet energies in atomic units from a .npy or .csv file."),
+    )
+    parser.add_argument(
+        "--soc-file",
+        "-socf",
+        help=(
+            "spin-orbit coupling matrix (rows=singlets, columns=triplets) in "
+            "inverse centimeters from a .npy or .csv file, e.g. from getmat.py"
+        ),
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        nargs="+",
+        help=(
+            "one or more .npz files with the arrays 'singlets', 'triplets' and "
+            "'socs' (optionally stacked with a leading molecule axis), or '-' "
+            "to read one JSON record per line from stdin"
+        ),
+    )
+    timings.add_arguments(parser)
 
     return parser.parse_args(args)
 
 
-def kISC(singlets, triplets, socs, gamma):
+def calc_kisc(singlets, triplets, socs, gamma):
+    """intersystem crossing rates in s**-1, rows=singlets columns=triplets"""
     # constants based on 2018 CODATA adjustments
     # https://physics.nist.gov/cuu/pdf/factors_2018.pdf
     # https://physics.nist.gov/cgi-bin/cuu/Value?c
@@ -81,7 +114,13 @@ def kISC(singlets, triplets, socs, gamma):
 
     # intersystem crossing rates in s**-1 according to equation (53)
     # from 10.1021/acs.jpca.1c06165
-    kisc = 2 / hbar * socs**2 * gamma / (ekl**2 + gamma**2)
+    return 2 / hbar * socs**2 * gamma / (ekl**2 + gamma**2)
+
+
+def kISC(singlets, triplets, socs, gamma):
+    print(get_soc_matrix(get_ekl_matrix(singlets, triplets), socs))
+
+    kisc = calc_kisc(singlets, triplets, socs, gamma)
 
     with np.printoptions(precision=2):
         print("\nSOCs Rows=Singlets Columns=Triplets")
@@ -99,23 +138,136 @@ def get_soc_matrix(ekl, socs):
     socs = np.array(socs)
     matrix = socs.reshape(ekl.shape)
 
-    print(matrix)
-
     return matrix
 
 
+def load_array(filename):
+    """reads a .npy file or a comma separated .csv file, text lines like the
+    one at the end of getmat.py's xyz_matrix.csv are skipped"""
+    if filename.endswith(".npy"):
+        return np.load(filename)
+
+    def is_number(text):
+        try:
+            float(text)
+        except ValueError:
+            return False
+        return True
+
+    with open(filename, "r") as handle:
+        rows = [line for line in handle if is_number(line.split(",")[0])]
+    return np.loadtxt(rows, delimiter=",", ndmin=1)
+
+
+def read_npz(filename):
+    """yields (name, singlets, triplets, socs, gamma) from an .npz file"""
+    with np.load(filename) as data:
+        singlets = data["singlets"]
+        triplets = data["triplets"]
+        socs = data["socs"]
+    if singlets.ndim == 1:
+        yield filename, singlets, triplets, socs, None
+        return
+    # stacked records: molecules along the first axis
+    for k in range(len(singlets)):
+        yield f"{filename}[{k}]", singlets[k], triplets[k], socs[k], None
+
+
+def read_stream(handle):
+    """yields (number, line) of the JSON lines that aren't empty or comments"""
+    for number, line in enumerate(handle, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        yield number, line
+
+
+def parse_record(number, line):
+    """(name, singlets, triplets, socs, gamma) of one JSON line
+
+    {"name": "mol1", "singlets": [...], "triplets": [...], "socs": [[...]]}
+    name and gamma are optional
+    """
+    record = json.loads(line)
+    return (
+        record.get("name", str(number)),
+        np.asarray(record["singlets"], dtype=float),
+        np.asarray(record["triplets"], dtype=float),
+        np.asarray(record["socs"], dtype=float),
+        record.get("gamma"),
+    )
+
+
+def run_records(inputs, gamma, out=sys.stdout):
+    """processes all records in one process and writes one JSON line each
+
+    a record that can't be read or computed gets {"name": ..., "error": ...}
+    and the next one is processed, so one bad line doesn't end a stream
+    """
+
+    def write(result):
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+    def process(name, singlets, triplets, socs, rec_gamma):
+        kisc = calc_kisc(
+            singlets,
+            triplets,
+            socs,
+            gamma if rec_gamma is None else rec_gamma,
+        )
+        write({"name": name, "kisc": kisc.tolist()})
+
+    for source in inputs:
+        if source == "-":
+            for number, line in read_stream(sys.stdin):
+                name = str(number)
+                try:
+                    record = parse_record(number, line)
+                    name = record[0]
+                    process(*record)
+                except Exception as error:
+                    write({"name": name, "error": str(error)})
+            continue
+        try:
+            records = list(read_npz(source))
+        except Exception as error:
+            write({"name": source, "error": str(error)})
+            continue
+        for record in records:
+            try:
+                process(*record)
+            except Exception as error:
+                write({"name": record[0], "error": str(error)})
+
+
 def main():
     args = getinput(sys.argv[1:])
 
-    print(args.singlet_energies)
-    print(args.triplet_energies)
+    with timings.session(args):
+        if args.input:
+            with timings.stage("run_records"):
+                run_records(args.input, args.gamma)
+            return
 
-    kISC(
-        args.singlet_energies,
-        args.triplet_energies,
-        args.spin_orbit_couplings,
-        args.gamma,
-    )
+        with timings.stage("load_array"):
+            if args.singlet_file:
+                args.singlet_energies = load_array(args.singlet_file)
+            if args.triplet_file:
+                args.triplet_energies = load_array(args.triplet_file)
+            if args.soc_file:
+                args.spin_orbit_couplings = load_array(args.soc_file)
+
+        print(args.singlet_energies)
+        print(args.triplet_energies)
+
+        with timings.stage("kISC"):
+            kISC(
+                args.singlet_energies,
+                args.triplet_energies,
+                args.spin_orbit_couplings,
+                args.gamma,
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+""" charge density difference (CDD = electron - hole) cubes from Multiwfn's
+hole and electron cubes, without another Multiwfn run """
+
+import os
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from cubetools import read_cube, load_cube, same_grid, write_header, write_grid, CACHE_DIR
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("compute CDD cubes from matching electron and hole cubes")
+    )
+    parser.add_argument(
+        "electrons",
+        nargs="*",
+        help="electron cubes, the hole cube is found by replacing 'electron' "
+        "with 'hole' in the name (default: *electron*.cub)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=os.cpu_count(),
+        type=int,
+        help="number of states processed in parallel (default: all cores)",
+    )
+    parser.add_argument(
+        "--chunk",
+        "-c",
+        default=16,
+        type=int,
+        help="number of grid planes held in memory at once (default: 16)",
+    )
+    parser.add_argument(
+        "--cube-cache",
+        action="store_true",
+        help=f"keep binary copies of the cubes in {CACHE_DIR}/ so the text is only parsed once",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="also recompute CDD cubes that are newer than their hole and electron cubes",
+    )
+
+    return parser.parse_args(args)
+
+
+def find_pairs(electrons):
+    """(electron, hole, cdd) file names, hole and CDD named after the electron cube"""
+    pairs = []
+    for electron in electrons:
+        head, tail = os.path.split(electron)
+        hole = os.path.join(head, tail.replace("electron", "hole"))
+        cdd = os.path.join(head, tail.replace("electron", "CDD"))
+        if not os.path.exists(hole):
+            print(f"no hole cube {hole} for {electron}")
+            continue
+        pairs.append((electron, hole, cdd))
+    return pairs
+
+
+def is_up_to_date(electron, hole, cdd):
+    return os.path.exists(cdd) and os.path.getmtime(cdd) >= max(
+        os.path.getmtime(electron), os.path.getmtime(hole)
+    )
+
+
+def make_cdd(electron, hole, cdd, chunk=16, cache=False):
+    """writes CDD = electron - hole, a few grid planes at a time"""
+    if cache:
+        ele, hol = load_cube(electron), load_cube(hole)
+    else:
+        ele, hol = read_cube(electron), read_cube(hole)
+    if not same_grid(ele, hol):
+        raise ValueError(f"{electron} and {hole} are not on the same grid")
+
+    try:
+        with open(cdd, "w") as handle:
+            write_header(handle, ele._replace(comments=["CDD = electron - hole", cdd]))
+            for k in range(0, len(ele.data), chunk):
+                write_grid(handle, ele.data[k : k + chunk] - hol.data[k : k + chunk])
+    except Exception:
+        # half a cube would look up to date next time
+        os.remove(cdd)
+        raise
+    return cdd
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    pairs = find_pairs(args.electrons or sorted(glob.glob("*electron*.cub")))
+    if not args.force:
+        pairs = [pair for pair in pairs if not is_up_to_date(*pair)]
+    print(f"{len(pairs)} CDD cubes to compute")
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = [
+            pool.submit(make_cdd, electron, hole, cdd, args.chunk, args.cube_cache)
+            for electron, hole, cdd in pairs
+        ]
+        # a broken pair is reported and the others are still written
+        for (electron, hole, cdd), future in zip(pairs, futures):
+            try:
+                print(f"{future.result()} written")
+            except Exception as error:
+                print(f"{cdd} failed: {error}")
+                failed += 1
+    if failed:
+        print(f"{failed} of {len(pairs)} CDD cubes failed")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
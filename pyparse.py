@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 """ parse the tddft stuff of gaussian """
 
+import os
 import sys
+import mmap
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import timings
 
 # import subprocess
 from pyparsing import *
 
 ParserElement.enablePackrat()
 
+# logs smaller than this are parsed in one piece
+PARALLEL_SIZE = 8 * 1024**2
+# hole-electron descriptors of holeelectron.py shown in the table
+DESCRIPTOR_COLUMNS = [("D", "D\n\u00C5"), ("Sr", "Sr"), ("H", "H\n\u00C5"), ("t", "t\n\u00C5")]
+
 
 def getinput(args):
     """parse the input"""
@@ -16,7 +26,11 @@ def getinput(args):
     parser.add_argument(
         "outputfile",
         metavar="G09-Output",
-        help="Typically *.log or *.out, but ending doesn't matter.",
+        nargs="+",
+        help=(
+            "Typically *.log or *.out, but ending doesn't matter. "
+            "Queries (--hole, --electron, --query) take several."
+        ),
     )
     parser.add_argument(
         "--out",
@@ -35,9 +49,8 @@ def getinput(args):
         "--states",
         "-st",
         nargs="+",
-        required=True,
         type=int,
-        help="Specify the wanted states. Else, all states are converted.",
+        help="Specify the wanted states, needed for the docx table.",
     )
     # s2_group = parser.add_mutually_exclusive_group(required=False)
     # s2_group.add_argument(
@@ -58,8 +71,65 @@ def getinput(args):
         default="pyparse",
         help="Specify which parser you want, to parse the files. None, pyparse",
     )
+    parser.add_argument(
+        "--descriptors",
+        "-d",
+        action="store_true",
+        help=(
+            "add hole-electron descriptors (D, Sr, H, t) computed from "
+            "hole000001.cub/electron000001.cub like cubes as extra columns"
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help=(
+            "number of worker processes for parsing big logs and for the "
+            "descriptors (default: all cores)"
+        ),
+    )
+    parser.add_argument(
+        "--hole",
+        "-ho",
+        help=(
+            "query: only excitations from these MOs, e.g. 205-207 or 205A,206B; "
+            "numbers without A/B match alpha, beta and closed shell MOs"
+        ),
+    )
+    parser.add_argument(
+        "--electron",
+        "-el",
+        help="query: only excitations to these MOs, e.g. 210,211,213-215",
+    )
+    parser.add_argument(
+        "--weight",
+        "-w",
+        default=8.0,
+        type=float,
+        help="query: minimum weight of an excitation in %% (default: 8)",
+    )
+    parser.add_argument(
+        "--query",
+        "-q",
+        action="store_true",
+        help="list the excitations above --weight instead of writing the docx table",
+    )
+    parser.add_argument(
+        "--index-cache",
+        action="store_true",
+        help="keep the excitation index of every log next to it as <log>.excitations.npz",
+    )
+    timings.add_arguments(parser)
 
-    return parser.parse_args(args)
+    args = parser.parse_args(args)
+    args.query = args.query or args.hole is not None or args.electron is not None
+    if not args.query:
+        if args.states is None:
+            parser.error("the following arguments are required: --states/-st")
+        if len(args.outputfile) > 1:
+            parser.error("the docx table is made of one log, several only work for queries")
+    return args
 
 def remove_last_line_from_string(string):
     """ removes the last line of a string"""
@@ -195,6 +265,210 @@ def parse_text(raw, args):
     return result
 
 
+def read_range(filename, start, end):
+    """ the text of a byte range of a file with the arrows spaced for parse_text """
+    if end <= start:
+        return ""
+    with open(filename, "rb") as handle:
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[start:end].decode(errors="replace")
+    return text.replace("->", "-> ").replace("<-", "<- ")
+
+
+def read_header(filename):
+    """ everything in front of the first excited state, where the multiplicity
+    and the number of basis functions are """
+    with open(filename, "rb") as handle:
+        size = os.fstat(handle.fileno()).st_size
+        if size == 0:
+            return ""
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = mm.find(b"Excited State")
+    return read_range(filename, 0, size if end < 0 else end)
+
+
+def chunk_bounds(filename, n_chunks):
+    """ byte ranges of the file, each but the first starting at an Excited State line """
+    with open(filename, "rb") as handle:
+        size = os.fstat(handle.fileno()).st_size
+        if size == 0 or n_chunks < 2:
+            return [(0, size)]
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            bounds = [0]
+            for k in range(1, n_chunks):
+                position = mm.find(b"Excited State", max(size * k // n_chunks, bounds[-1]))
+                if position < 0:
+                    break
+                start = mm.rfind(b"\n", 0, position) + 1
+                if start > bounds[-1]:
+                    bounds.append(start)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_range(filename, start, end):
+    """ parse_text of a byte range as plain lists, so they can leave a worker """
+    result = parse_text(read_range(filename, start, end), argparse.Namespace(parser="pyparse"))
+    return [
+        [list(state), [list(excitation) for excitation in excitations]]
+        for state, excitations in result
+    ]
+
+
+def parse_file(filename, jobs=None):
+    """ parse_text of a whole log, big logs are cut at Excited State lines and
+    the pieces parsed in a process pool, the states stay in the order of the log """
+    if jobs == 1 or os.path.getsize(filename) < PARALLEL_SIZE:
+        return parse_range(filename, 0, os.path.getsize(filename))
+    jobs = jobs or os.cpu_count()
+    # more pieces than workers, the states aren't spread evenly over a log
+    ranges = chunk_bounds(filename, 4 * jobs)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        parts = pool.map(parse_range, [filename] * len(ranges), *zip(*ranges))
+        return [state for part in parts for state in part]
+
+
+def significant_excitations(excitations, scale, threshold=8.0):
+    """ (from, to, weight in %) of the excitations with a weight >= threshold """
+    result = []
+    for entry in excitations:
+        if entry[1] == "->":
+            weight = 100.0 / scale * entry[3] ** 2
+            if weight >= threshold:
+                result.append((entry[0], entry[2], weight))
+    return result
+
+
+def parse_mos(text):
+    """ '205-207,210A' -> [(205, ''), (206, ''), (207, ''), (210, 'A')] """
+    mos = []
+    for part in text.split(","):
+        first, _, last = part.strip().partition("-")
+        spin = (first + last)[-1] if (first + last)[-1:] in ("A", "B") else ""
+        first, last = first.rstrip("AB"), (last or first).rstrip("AB")
+        mos += [(nr, spin) for nr in range(int(first), int(last) + 1)]
+    return mos
+
+
+def build_index(content, scale):
+    """ all excitations (->) of the parsed states as columns sorted by the
+    from-MO, weights in % as in to_docx """
+    import numpy as np
+
+    rows = []
+    for state, excitations in content:
+        nr, en, wl, osc, sc = state
+        for entry in excitations:
+            if entry[1] != "->":
+                continue
+            origin, target = entry[0], entry[2]
+            rows.append(
+                (
+                    int(nr), float(en), float(wl), float(osc),
+                    int(origin.rstrip("AB")), origin[-1] if origin[-1] in "AB" else "",
+                    int(target.rstrip("AB")), target[-1] if target[-1] in "AB" else "",
+                    100.0 / scale * entry[3] ** 2,
+                )
+            )
+    dtype = [
+        ("state", int), ("energy", float), ("wavelength", float), ("osc", float),
+        ("from_mo", int), ("from_spin", "U1"), ("to_mo", int), ("to_spin", "U1"),
+        ("weight", float),
+    ]
+    index = np.array(rows, dtype=dtype)
+    return index[np.argsort(index["from_mo"], kind="stable")]
+
+
+def load_index(filename, jobs=None, cache=False):
+    """ the excitation index of a log, from <log>.excitations.npz if that is
+    newer than the log """
+    import numpy as np
+
+    cachename = filename + ".excitations.npz"
+    stat = os.stat(filename)
+    if cache and os.path.exists(cachename):
+        with np.load(cachename) as stored:
+            if stored["stamp"].tolist() == [stat.st_size, stat.st_mtime]:
+                return stored["index"]
+    scale, _ = is_closed_shell(read_header(filename), argparse.Namespace(parser="pyparse"))
+    index = build_index(parse_file(filename, jobs), scale)
+    if cache:
+        np.savez(cachename, index=index, stamp=np.array([stat.st_size, stat.st_mtime]))
+    return index
+
+
+def mo_mask(numbers, spins, wanted):
+    """ which rows go from/to one of the wanted (number, spin) MOs """
+    import numpy as np
+
+    mask = np.zeros(len(numbers), dtype=bool)
+    for spin in ("", "A", "B"):
+        chosen = [nr for nr, label in wanted if label == spin]
+        if not chosen:
+            continue
+        found = np.isin(numbers, chosen)
+        mask |= found if spin == "" else found & (spins == spin)
+    return mask
+
+
+def query(index, hole=None, electron=None, threshold=8.0):
+    """ rows of the index above the threshold that start at a hole MO and end
+    at an electron MO, hole and electron as lists of parse_mos """
+    import numpy as np
+
+    rows = index
+    if hole:
+        # the index is sorted by from-MO, the hole MOs are a few slices of it
+        numbers = sorted({nr for nr, _ in hole})
+        slices = [
+            rows[np.searchsorted(rows["from_mo"], nr) : np.searchsorted(rows["from_mo"], nr, "right")]
+            for nr in numbers
+        ]
+        rows = np.concatenate(slices) if slices else rows[:0]
+        rows = rows[mo_mask(rows["from_mo"], rows["from_spin"], hole)]
+    if electron:
+        rows = rows[mo_mask(rows["to_mo"], rows["to_spin"], electron)]
+    rows = rows[rows["weight"] >= threshold]
+    return rows[np.lexsort((rows["from_mo"], rows["state"]))]
+
+
+def print_query(filename, rows):
+    """ the matches grouped by state like the awk one-liners of code_snippets.adoc """
+    last = None
+    for row in rows:
+        if row["state"] != last:
+            last = row["state"]
+            print(
+                f"{filename}  Excited State {row['state']:3d}:  {row['energy']:.4f} eV "
+                f"{row['wavelength']:7.2f} nm  f={row['osc']:.4f}"
+            )
+        print(
+            f"    {row['from_mo']}{row['from_spin']:1s} -> "
+            f"{row['to_mo']}{row['to_spin']:1s}   {row['weight']:5.1f}"
+        )
+
+
+def needed_orbitals(content, scale, states, basisfunctions):
+    """ numbers of the MOs shown for the wanted states
+
+    the same ranges as in the MO table of to_docx, beta MOs are shifted by the
+    number of basis functions like Multiwfn numbers them
+    """
+    mos = []
+    for state, excitations in content:
+        if int(state[0]) in states:
+            for origin, target, _ in significant_excitations(excitations, scale):
+                mos += [origin, target]
+    closed = [int(x) for x in mos if "A" not in x and "B" not in x]
+    alpha = [int(x.replace("A", "")) for x in mos if "A" in x]
+    beta = [basisfunctions + int(x.replace("B", "")) for x in mos if "B" in x]
+    orbitals = set()
+    for group in (closed, alpha, beta):
+        if group:
+            orbitals.update(range(min(group), max(group) + 1))
+    return orbitals
+
+
 # https://github.com/python-openxml/python-docx/issues/322
 def set_repeat_table_header(row):
     """ set repeat table row on every new page
@@ -208,8 +482,11 @@ def set_repeat_table_header(row):
     return row
 
 
-def to_docx(content, scale, inputargs, basisfunctions):
-    """ writes content into a ms word table """
+def to_docx(content, scale, inputargs, basisfunctions, descriptors=None):
+    """ writes content into a ms word table
+
+    descriptors: hole-electron descriptors per state number as extra columns
+    """
     from docx import Document
     from docx.shared import Pt, Cm
     from docx.enum.table import WD_CELL_VERTICAL_ALIGNMENT
@@ -242,7 +519,8 @@ def to_docx(content, scale, inputargs, basisfunctions):
     # [['3', '18.1202', '68.42', '0.0672', '0.000'], [['3', '->', '7', '0.12606'], ['4', '->', '6', '0.69577']]]
     # NR_OF_STATES = len(content)
 
-    table = document.add_table(rows=1, cols=10)
+    n_cols = 10 if descriptors is None else 10 + len(DESCRIPTOR_COLUMNS)
+    table = document.add_table(rows=1, cols=n_cols)
     table.allow_autofit = True
     hdr_cells = table.rows[0].cells
     hdr_cells[0].text = "Nr"
@@ -255,33 +533,33 @@ def to_docx(content, scale, inputargs, basisfunctions):
     hdr_cells[7].text = "To"
     hdr_cells[8].text = "Hole"
     hdr_cells[9].text = "Electron"
+    if descriptors is not None:
+        for k, (_, label) in enumerate(DESCRIPTOR_COLUMNS):
+            hdr_cells[10 + k].text = label
     set_repeat_table_header(table.rows[0])
     wanted = inputargs.states
     mos = []
     for item in content:
         state, excitations = item
-        state.nr, state.en, state.wl, state.f, state.sc = state
-        if not int(state.nr) in wanted:
+        nr, en, wl, osc, sc = state
+        if not int(nr) in wanted:
             continue
         row_cells = table.add_row().cells
        # row_cells.vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER
-        row_cells[0].text = state.nr
-        row_cells[1].text = f"{state.en:.2f}"
-        row_cells[2].text = f"{state.wl:.0f}"
-        row_cells[3].text = state.f
-        row_cells[4].text = state.sc
+        row_cells[0].text = nr
+        row_cells[1].text = f"{float(en):.2f}"
+        row_cells[2].text = f"{float(wl):.0f}"
+        row_cells[3].text = osc
+        row_cells[4].text = sc
         weights = ""
         froms = ""
         tos = ""
-        for entry in excitations:
-            if entry[1] == "->":
-                weight = 100.0 / scale * entry[3] ** 2
-                if weight >= 8.0:
-                    weights = weights + f"{weight:.0f}" + "\n"
-                    froms = froms + entry[0] + "\n"
-                    tos = tos + entry[2] + "\n"
-                    mos.append(entry[0])
-                    mos.append(entry[2])
+        for origin, target, weight in significant_excitations(excitations, scale):
+            weights = weights + f"{weight:.0f}" + "\n"
+            froms = froms + origin + "\n"
+            tos = tos + target + "\n"
+            mos.append(origin)
+            mos.append(target)
         weights = remove_last_line_from_string(weights)
         froms = remove_last_line_from_string(froms)
         tos = remove_last_line_from_string(tos)
@@ -292,45 +570,49 @@ def to_docx(content, scale, inputargs, basisfunctions):
         try:
             paragraph = row_cells[8].paragraphs[0]
             run = paragraph.add_run()
-            run.add_picture(f"hole{int(state.nr):06}_thumb.jpg", width=Cm(3.0))
+            run.add_picture(f"hole{int(nr):06}_thumb.jpg", width=Cm(3.0))
         except:
             pass
 
         try:
             paragraph = row_cells[8].paragraphs[0]
             run = paragraph.add_run()
-            run.add_picture(f"hole{int(state.nr):06}_thumb.jpeg", width=Cm(3.0))
+            run.add_picture(f"hole{int(nr):06}_thumb.jpeg", width=Cm(3.0))
         except:
             pass
 
         try:
             paragraph = row_cells[8].paragraphs[0]
             run = paragraph.add_run()
-            run.add_picture(f"hole{int(state.nr):06}_thumb.png", width=Cm(3.0))
+            run.add_picture(f"hole{int(nr):06}_thumb.png", width=Cm(3.0))
         except:
             pass
 
         try:
             paragraph = row_cells[9].paragraphs[0]
             run = paragraph.add_run()
-            run.add_picture(f"electron{int(state.nr):06}_thumb.jpg", width=Cm(3.0))
+            run.add_picture(f"electron{int(nr):06}_thumb.jpg", width=Cm(3.0))
         except:
             pass
 
         try:
             paragraph = row_cells[9].paragraphs[0]
             run = paragraph.add_run()
-            run.add_picture(f"electron{int(state.nr):06}_thumb.jpeg", width=Cm(3.0))
+            run.add_picture(f"electron{int(nr):06}_thumb.jpeg", width=Cm(3.0))
         except:
             pass
 
         try:
             paragraph = row_cells[9].paragraphs[0]
             run = paragraph.add_run()
-            run.add_picture(f"electron{int(state.nr):06}_thumb.png", width=Cm(3.0))
+            run.add_picture(f"electron{int(nr):06}_thumb.png", width=Cm(3.0))
         except:
             pass
 
+        if descriptors is not None and int(nr) in descriptors:
+            for k, (key, _) in enumerate(DESCRIPTOR_COLUMNS):
+                row_cells[10 + k].text = f"{descriptors[int(nr)][key]:.2f}"
+
     # document.save(inputargs.out)
 
     sorted_mos = sorted(list(set(mos)))
@@ -481,33 +763,46 @@ def to_docx(content, scale, inputargs, basisfunctions):
 
 if __name__ == "__main__":
     ARGS = getinput(sys.argv[1:])
-    # FILE_CONTENT = (
-    #   open(ARGS.outputfile, "r").read().replace("->", "-> ").replace("<-", "<- ")
-    # )
-    # MY_FILE = open(ARGS.outputfile, "r").readlines()
-    MY_FILE = open(ARGS.outputfile, "r").read()
-    # FILE_CONTENT = []
-    # for line in MY_FILE:
-    #     if (
-    #         "basis functions"
-    #         or "Multiplicity"
-    #         or "Excited State"
-    #         or "->"
-    #         or "<-" in line
-    #     ):
-    #         FILE_CONTENT.append(line.replace("->", "-> ").replace("<-", "<- "))
-    # FILE_CONTENT = "".join(FILE_CONTENT)
-    FILE_CONTENT = MY_FILE.replace("->", "-> ").replace("<-", "<- ")
-    SCALE_FACTOR, MULTIPLICITY = is_closed_shell(FILE_CONTENT, ARGS)
-    # formatierter_string = f"{ein_float:.2f}"
-    print(
-        (
-            "The molecule is of Multiplicity " + str(MULTIPLICITY) + " and thus "
-            "the excitations will be scaled by " + str(SCALE_FACTOR)
+    if ARGS.query:
+        with timings.session(ARGS):
+            HOLE = parse_mos(ARGS.hole) if ARGS.hole else None
+            ELECTRON = parse_mos(ARGS.electron) if ARGS.electron else None
+            for FILENAME in ARGS.outputfile:
+                with timings.stage(f"index {FILENAME}"):
+                    INDEX = load_index(FILENAME, ARGS.jobs, ARGS.index_cache)
+                with timings.stage(f"query {FILENAME}"):
+                    print_query(FILENAME, query(INDEX, HOLE, ELECTRON, ARGS.weight))
+        sys.exit(0)
+    ARGS.outputfile = ARGS.outputfile[0]
+    with timings.session(ARGS):
+        # the multiplicity and the basis functions are in front of the excited
+        # states, the rest of the log is only read piece by piece by parse_file
+        with timings.stage("read_header"):
+            HEADER = read_header(ARGS.outputfile)
+        with timings.stage("is_closed_shell"):
+            SCALE_FACTOR, MULTIPLICITY = is_closed_shell(HEADER, ARGS)
+        # formatierter_string = f"{ein_float:.2f}"
+        print(
+            (
+                "The molecule is of Multiplicity " + str(MULTIPLICITY) + " and thus "
+                "the excitations will be scaled by " + str(SCALE_FACTOR)
+            )
         )
-    )
-    # num_basis_functions(FILE_CONTENT)
-    output = parse_text(FILE_CONTENT, ARGS)
-    to_docx(
-        parse_text(FILE_CONTENT, ARGS), SCALE_FACTOR, ARGS, num_basis_functions(FILE_CONTENT, ARGS)
-    )
+        with timings.stage("parse_text"):
+            output = parse_file(ARGS.outputfile, ARGS.jobs)
+        DESCRIPTORS = None
+        if ARGS.descriptors:
+            from holeelectron import state_descriptors
+
+            with timings.stage("state_descriptors"):
+                DESCRIPTORS = state_descriptors(ARGS.states, ARGS.jobs)
+        with timings.stage("num_basis_functions"):
+            BASIS_FUNCTIONS = num_basis_functions(HEADER, ARGS)
+        with timings.stage("to_docx"):
+            to_docx(
+                output,
+                SCALE_FACTOR,
+                ARGS,
+                BASIS_FUNCTIONS,
+                DESCRIPTORS,
+            )
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+""" imports the scripts whose file names aren't module names, e.g.
+Fafoom-backup2sdf.py, for watch.py and the benchmarks """
+
+import os
+import importlib.util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# scripts loaded by load_script, each one is executed once per process
+SCRIPTS = {}
+
+
+def load_script(name, filename):
+    """the script filename next to this file as module name"""
+    if name not in SCRIPTS:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        SCRIPTS[name] = module
+    return SCRIPTS[name]
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+""" broadened UV-Vis spectra of the excited states of Gaussian logs (pyparse.py)
+and ORCA outputs (getmat.py), many molecules at once and without a display """
+
+import io
+import sys
+import argparse
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import timings
+
+EV_NM = 1239.84  # eV nm
+ICM_PER_EV = 8065.544  # cm**-1 / eV
+# molar absorptivity in L mol**-1 cm**-1 of f = 1 spread over a line shape in eV**-1
+EPSILON_PER_F = 28700.0
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("broadened UV-Vis spectra of Gaussian and ORCA excited states")
+    )
+    parser.add_argument("outputs", nargs="+", help="Gaussian logs and/or ORCA outputs")
+    parser.add_argument(
+        "--shape",
+        "-s",
+        default="gaussian",
+        choices=["gaussian", "lorentzian"],
+        help="line shape (default: gaussian)",
+    )
+    parser.add_argument(
+        "--fwhm",
+        default=0.3,
+        type=float,
+        help="full width at half maximum of the lines in eV (default: 0.3)",
+    )
+    parser.add_argument(
+        "--grid",
+        "-g",
+        default="wavelength",
+        choices=["energy", "wavelength"],
+        help="spectrum over energy (eV) or wavelength (nm), default wavelength",
+    )
+    parser.add_argument(
+        "--range",
+        "-r",
+        nargs=2,
+        type=float,
+        help="first and last grid point in eV or nm (default: 200 800 nm or 1.5 6 eV)",
+    )
+    parser.add_argument(
+        "--points", "-n", default=2000, type=int, help="grid points (default: 2000)"
+    )
+    parser.add_argument(
+        "--chunk",
+        "-c",
+        default=512,
+        type=int,
+        help="states broadened at once, bounds the memory (default: 512)",
+    )
+    parser.add_argument(
+        "--plot", "-p", action="store_true", help="also write <output>.spectrum.png"
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="number of worker processes reading the outputs (default: all cores)",
+    )
+    parser.add_argument(
+        "--npz",
+        default="spectra.npz",
+        help="all spectra in one file, arrays grid, spectra and names (default: spectra.npz)",
+    )
+    timings.add_arguments(parser)
+
+    return parser.parse_args(args)
+
+
+def is_orca(filename):
+    with open(filename, "rb") as handle:
+        return b"O   R   C   A" in handle.read(65536)
+
+
+def gaussian_states(filename):
+    """excitation energies in eV and oscillator strengths of a Gaussian log"""
+    import pyparse
+
+    content = pyparse.parse_file(filename, jobs=1)
+    energies = np.array([float(state[1]) for state, _ in content])
+    strengths = np.array([float(state[3]) for state, _ in content])
+    return energies, strengths
+
+
+def orca_states(filename):
+    """excitation energies in eV and oscillator strengths of the singlets of an ORCA output"""
+    import getmat
+
+    with redirect_stdout(io.StringIO()):
+        singlets, _ = getmat.get_orca_excited_states(getmat.get_lines(filename))
+    # the first row is the ground state, the others are shifted by its energy
+    energies = (singlets[1:, 1] - singlets[0, 1]) / ICM_PER_EV
+    return energies, singlets[1:, 3]
+
+
+def load_states(filename):
+    if is_orca(filename):
+        return orca_states(filename)
+    return gaussian_states(filename)
+
+
+def line_shape(delta, fwhm, shape="gaussian"):
+    """area normalized line shape in eV**-1 at delta = E - E_state in eV"""
+    if shape == "lorentzian":
+        half = fwhm / 2
+        return half / np.pi / (delta**2 + half**2)
+    sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+    return np.exp(-0.5 * (delta / sigma) ** 2) / (sigma * np.sqrt(2 * np.pi))
+
+
+def broaden(energies, strengths, grid, fwhm=0.3, shape="gaussian", chunk=512):
+    """molar absorptivity on the energy grid (eV)
+
+    energies and strengths are (n_states,) or (n_molecules, n_states), padded
+    with zero strengths, the result is (n_points,) or (n_molecules, n_points).
+    the states are broadened chunk by chunk, so at most
+    n_molecules x chunk x n_points values are held at once
+    """
+    single = np.ndim(strengths) == 1
+    energies = np.atleast_2d(energies)
+    strengths = np.atleast_2d(strengths)
+    spectra = np.zeros((len(energies), len(grid)))
+    for start in range(0, energies.shape[1], chunk):
+        delta = grid[None, None, :] - energies[:, start : start + chunk, None]
+        spectra += np.einsum(
+            "ms,msp->mp", strengths[:, start : start + chunk], line_shape(delta, fwhm, shape)
+        )
+    spectra *= EPSILON_PER_F
+    return spectra[0] if single else spectra
+
+
+def pad(states):
+    """(energies, strengths) of many molecules as two zero padded 2d arrays"""
+    width = max([len(energies) for energies, _ in states] + [1])
+    energies = np.zeros((len(states), width))
+    strengths = np.zeros((len(states), width))
+    for k, (e, f) in enumerate(states):
+        energies[k, : len(e)] = e
+        strengths[k, : len(f)] = f
+    return energies, strengths
+
+
+def make_grid(kind, points, limits=None):
+    """the grid in its own unit and as energies in eV"""
+    if kind == "wavelength":
+        start, stop = limits or (200.0, 800.0)
+        grid = np.linspace(start, stop, points)
+        return grid, EV_NM / grid
+    start, stop = limits or (1.5, 6.0)
+    grid = np.linspace(start, stop, points)
+    return grid, grid
+
+
+def plot(filename, grid, spectrum, energies, strengths, kind):
+    """spectrum and sticks as png, rendered without a display"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(6, 3.5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.plot(grid, spectrum, color="k")
+    ax.set_ylabel("ε / L mol$^{-1}$ cm$^{-1}$")
+    sticks = ax.twinx()
+    positions = EV_NM / energies if kind == "wavelength" else energies
+    inside = (positions >= grid.min()) & (positions <= grid.max())
+    sticks.vlines(positions[inside], 0, strengths[inside], color="tab:red")
+    sticks.set_ylabel("f")
+    sticks.set_ylim(bottom=0)
+    ax.set_xlabel("λ / nm" if kind == "wavelength" else "E / eV")
+    ax.set_xlim(grid.min(), grid.max())
+    ax.set_ylim(bottom=0)
+    fig.tight_layout()
+    fig.savefig(filename, dpi=150)
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    with timings.session(args):
+        with timings.stage("read"):
+            with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                states = list(pool.map(load_states, args.outputs))
+        grid, grid_ev = make_grid(args.grid, args.points, args.range)
+        with timings.stage("broaden"):
+            energies, strengths = pad(states)
+            spectra = broaden(energies, strengths, grid_ev, args.fwhm, args.shape, args.chunk)
+        with timings.stage("write"):
+            np.savez(args.npz, grid=grid, spectra=spectra, names=np.array(args.outputs))
+            unit = "nm" if args.grid == "wavelength" else "eV"
+            for name, spectrum, (e, f) in zip(args.outputs, spectra, states):
+                np.savetxt(
+                    name + ".spectrum.csv",
+                    np.column_stack([grid, spectrum]),
+                    delimiter=",",
+                    header=f"{args.grid}/{unit},epsilon/(L/mol/cm)",
+                    comments="",
+                )
+                if args.plot:
+                    plot(name + ".spectrum.png", grid, spectrum, e, f, args.grid)
+                print(f"{name}: {len(e)} states -> {name}.spectrum.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+""" shrink the rendered hole, electron and MO images to the *_thumb images
+that pyparse.py's to_docx puts into the table """
+
+import os
+import re
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# hole000001.jpeg, electron1.png, orb000205.jpeg ... -> kind and number
+IMAGE_NAME = re.compile(r"^(hole|electron|orb)\D*?0*(\d+)\.(jpe?g|png)$")
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("thumbnails with the names and widths used by pyparse.py")
+    )
+    parser.add_argument(
+        "images",
+        nargs="*",
+        help="rendered images (default: all hole, electron and orb images)",
+    )
+    parser.add_argument(
+        "--cdd-image-width",
+        "-ciw",
+        default=3.0,
+        type=float,
+        help="width of the hole and electron thumbnails in cm (default: 3 cm)",
+    )
+    parser.add_argument(
+        "--mo-image-width",
+        "-mow",
+        default=2.6,
+        type=float,
+        help="width of the MO thumbnails in cm (default: 2.6 cm)",
+    )
+    parser.add_argument(
+        "--dpi", "-d", default=300, type=int, help="DPI of the thumbnails, default 300"
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="number of worker processes (default: all cores)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="also rewrite thumbnails that are newer than their images",
+    )
+
+    return parser.parse_args(args)
+
+
+def thumb_name(image):
+    """the name to_docx looks for, e.g. hole000001_thumb.jpeg, None for other images"""
+    head, tail = os.path.split(image)
+    match = IMAGE_NAME.match(tail)
+    if match is None:
+        return None
+    kind, number, ext = match.groups()
+    return os.path.join(head, f"{kind}{int(number):06}_thumb.{ext}")
+
+
+def find_images():
+    """all rendered hole, electron and MO images that aren't thumbnails"""
+    images = []
+    for pattern in ("hole*", "electron*", "orb*"):
+        images += [
+            image
+            for image in glob.glob(pattern)
+            if "_thumb." not in image and thumb_name(image) is not None
+        ]
+    return sorted(images)
+
+
+def is_up_to_date(image, thumb):
+    return os.path.exists(thumb) and os.path.getmtime(thumb) >= os.path.getmtime(image)
+
+
+def make_thumb(image, thumb, width_cm, dpi):
+    """resizes an image to width_cm at the given dpi"""
+    from PIL import Image
+
+    width = max(1, round(width_cm / 2.54 * dpi))
+    with Image.open(image) as picture:
+        height = max(1, round(picture.height * width / picture.width))
+        small = picture.resize((width, height), Image.LANCZOS)
+        if thumb.endswith((".jpg", ".jpeg")) and small.mode not in ("RGB", "L"):
+            small = small.convert("RGB")
+        small.save(thumb, dpi=(dpi, dpi))
+    return thumb
+
+
+def make_thumbs(images, cdd_width=3.0, mo_width=2.6, dpi=300, jobs=None, force=False):
+    """writes the outdated thumbnails of the images in a process pool"""
+    todo = []
+    for image in images:
+        thumb = thumb_name(image)
+        if thumb is None or (not force and is_up_to_date(image, thumb)):
+            continue
+        width = mo_width if os.path.basename(thumb).startswith("orb") else cdd_width
+        todo.append((image, thumb, width, dpi))
+    if not todo:
+        return []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(make_thumb, *zip(*todo)))
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    images = args.images or find_images()
+    thumbs = make_thumbs(
+        images,
+        args.cdd_image_width,
+        args.mo_image_width,
+        args.dpi,
+        args.jobs,
+        args.force,
+    )
+    print(f"{len(thumbs)} of {len(images)} thumbnails written")
+
+
+if __name__ == "__main__":
+    main()
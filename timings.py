@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+""" wall time and peak memory of the stages of a script run (--timings) and
+cProfile statistics of the whole run (--profile), shared by all scripts """
+
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # windows, no peak RSS there
+    resource = None
+
+# (stage, seconds, peak RSS of the process in MB, peak RSS of the children in MB)
+STAGES = []
+# stages are only recorded inside a session with --timings, scripts used as
+# libraries (watch.py, the benchmarks) don't collect them
+RECORDING = False
+
+
+def add_arguments(parser):
+    """adds --timings and --profile to an argparse parser"""
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="print wall time and peak memory of every stage to stderr",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write cProfile statistics of the run to FILE (python -m pstats FILE)",
+    )
+
+
+def peak_rss(who="self"):
+    """peak resident set size in MB of this process or of its waited-for children"""
+    if resource is None:
+        return float("nan")
+    usage = resource.getrusage(
+        resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN
+    )
+    # kB on linux, bytes on macOS
+    if sys.platform == "darwin":
+        return usage.ru_maxrss / 1024**2
+    return usage.ru_maxrss / 1024
+
+
+@contextmanager
+def stage(name):
+    """records the wall time of the block and the peak RSS after it"""
+    if not RECORDING:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGES.append(
+            (name, time.perf_counter() - start, peak_rss("self"), peak_rss("children"))
+        )
+
+
+def report(out=sys.stderr):
+    """the table of all recorded stages"""
+    out.write(f"{'stage':30s} {'wall/s':>9s} {'peak RSS/MB':>12s} {'children/MB':>12s}\n")
+    for name, seconds, rss, children in STAGES:
+        out.write(f"{name:30s} {seconds:9.3f} {rss:12.1f} {children:12.1f}\n")
+    out.write(f"{'total':30s} {sum(s[1] for s in STAGES):9.3f}\n")
+
+
+@contextmanager
+def session(args):
+    """profiles the block for --profile and reports the stages for --timings"""
+    global RECORDING
+
+    recording = RECORDING
+    if getattr(args, "timings", False):
+        RECORDING = True
+        del STAGES[:]
+    profiler = None
+    if getattr(args, "profile", None):
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"profile written to {args.profile}", file=sys.stderr)
+        if getattr(args, "timings", False):
+            report()
+            del STAGES[:]
+        RECORDING = recording
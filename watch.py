@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+""" watches running fafoom, Gaussian and ORCA jobs and converts only what
+they appended since the last look:
+
+backup_population.dat, backup_blacklist.dat -> population.sdf, blacklist.sdf
+Gaussian log  -> <log>.states.jsonl, one line per excited state
+ORCA output   -> <out>.states.jsonl, one line per TDDFT state with its block
+                 (singlets/triplets) and TDDFT step, and the SOCME
+                 matrices <out>.socme_ms.csv / <out>.socme_xyz.csv when it ends
+"""
+
+import os
+import io
+import re
+import sys
+import json
+import time
+import argparse
+from argparse import Namespace
+from contextlib import redirect_stdout
+
+from scripttools import load_script
+
+# where the files were read up to, one per watched directory
+WATCH_STATE = "watch_state.json"
+# bytes read from the beginning to tell Gaussian from ORCA
+SNIFF = 65536
+# bytes before the offset that must not change, else the file was rewritten
+CHECK = 64
+FAFOOM_BACKUPS = {
+    "backup_population.dat": "population.sdf",
+    "backup_blacklist.dat": "blacklist.sdf",
+}
+# STATE  1:  E=   0.121012 au      3.293 eV    26559.3 cm**-1 <S**2> =   0.000000 Mult 1
+ORCA_STATE = re.compile(
+    r"STATE\s+(\d+):\s+E=\s*(\S+)\s+au\s+(\S+)\s+eV\s+(\S+)\s+cm\*\*-1"
+    r"(?:\s+<S\*\*2>\s*=\s*(\S+))?(?:\s+Mult\s+(\d+))?"
+)
+GAUSSIAN_BLANK = re.compile(rb"\n[ \t]*\n")
+
+
+def get_input(args):
+    """parse the input"""
+    parser = argparse.ArgumentParser(
+        description=("convert fafoom backups and parse Gaussian and ORCA outputs as jobs write them")
+    )
+    parser.add_argument("dirs", nargs="+", help="job directories")
+    parser.add_argument(
+        "--recursive",
+        "-r",
+        action="store_true",
+        help="also watch all subdirectories, new ones are picked up while watching",
+    )
+    parser.add_argument(
+        "--interval",
+        "-i",
+        default=10.0,
+        type=float,
+        help="seconds between two looks at the files (default: 10)",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="convert what is new and exit"
+    )
+    parser.add_argument(
+        "--no-inotify",
+        action="store_true",
+        help="only poll, even if inotify_simple is installed",
+    )
+
+    return parser.parse_args(args)
+
+
+def job_dirs(roots, recursive):
+    """the watched directories"""
+    dirs = []
+    for root in roots:
+        if recursive:
+            dirs += [path for path, _, _ in os.walk(root)]
+        else:
+            dirs.append(root)
+    return dirs
+
+
+def file_kind(path):
+    """fafoom, gaussian, orca or None for everything else"""
+    name = os.path.basename(path)
+    if name in FAFOOM_BACKUPS:
+        return "fafoom"
+    if not name.endswith((".log", ".out")):
+        return None
+    with open(path, "rb") as handle:
+        head = handle.read(SNIFF)
+    if b"O   R   C   A" in head:
+        return "orca"
+    if b"Gaussian" in head:
+        return "gaussian"
+    return None
+
+
+def read_state(directory):
+    try:
+        with open(os.path.join(directory, WATCH_STATE)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(directory, state):
+    # written to a temporary file first so a kill never leaves half a state
+    name = os.path.join(directory, WATCH_STATE)
+    with open(name + ".tmp", "w") as handle:
+        json.dump(state, handle)
+    os.replace(name + ".tmp", name)
+
+
+def outputs(path, kind):
+    """the files written for a watched file"""
+    if kind == "fafoom":
+        return [os.path.join(os.path.dirname(path), FAFOOM_BACKUPS[os.path.basename(path)])]
+    if kind == "gaussian":
+        return [path + ".states.jsonl"]
+    return [path + ".states.jsonl", path + ".socme_ms.csv", path + ".socme_xyz.csv"]
+
+
+def new_bytes(path, kind, entry):
+    """the bytes appended since the entry's offset and where they start
+
+    a file that shrank or whose bytes before the offset changed was rewritten,
+    its outputs are removed and it is read from the beginning again
+    """
+    with open(path, "rb") as handle:
+        size = os.fstat(handle.fileno()).st_size
+        offset = entry.get("offset", 0)
+        if offset:
+            check_start = max(0, offset - CHECK)
+            handle.seek(check_start)
+            if size < offset or handle.read(offset - check_start).hex() != entry.get("check"):
+                for name in outputs(path, kind):
+                    if os.path.exists(name):
+                        os.remove(name)
+                entry.clear()
+                offset = 0
+        handle.seek(offset)
+        return handle.read(), offset
+
+
+def complete_end(data, kind):
+    """length of the part of data that only holds complete records"""
+    if kind == "gaussian":
+        # an excited state is complete once the blank line after it is written
+        end = 0
+        for match in GAUSSIAN_BLANK.finditer(data):
+            end = match.end() - 1
+        return end
+    # one structure per line in fafoom's backups, ORCA is parsed line by line
+    return data.rfind(b"\n") + 1
+
+
+def update_fafoom(path, text, entry):
+    fafoom = load_script("fafoom_backup2sdf", "Fafoom-backup2sdf.py")
+    blocks, _, entry["iszero"] = fafoom.convert_records(text, entry.get("iszero", 0))
+    with open(outputs(path, "fafoom")[0], "a") as sdffile:
+        sdffile.writelines(blocks)
+    return len(blocks)
+
+
+def update_gaussian(path, text, entry):
+    import pyparse
+
+    text = text.replace("->", "-> ").replace("<-", "<- ")
+    match = re.search(r"Multiplicity\s*=\s*(\d+)", text)
+    if match:
+        entry["multiplicity"] = int(match.group(1))
+    records = []
+    for state, excitations in pyparse.parse_text(text, Namespace(parser="pyparse")):
+        nr, en, wl, osc, sc = state
+        records.append(
+            {
+                "state": int(nr),
+                "energy_ev": float(en),
+                "wavelength_nm": float(wl),
+                "f": float(osc),
+                "s2": float(sc),
+                "multiplicity": entry.get("multiplicity"),
+                "excitations": [list(excitation) for excitation in excitations],
+            }
+        )
+    with open(outputs(path, "gaussian")[0], "a") as handle:
+        for record in records:
+            handle.write(json.dumps(record) + "\n")
+    return len(records)
+
+
+def update_orca(path, data, entry, start):
+    """the states of the new bytes of an ORCA output, the SOCME offsets are
+    counted in bytes of the file, so the lines are only decoded one by one"""
+    records = []
+    position = start
+    finished = False
+    for raw in data.splitlines(keepends=True):
+        line = raw.decode(errors="replace")
+        if "Number of roots to be determined" in line:
+            entry["roots_line"] = line
+        elif "EXCITED STATES" in line and "SOC" not in line:
+            # like getmat.iter_scan_steps, a step starts with every singlet
+            # (or unrestricted) block, ORCA 5 prints no Mult to tell them apart
+            if "(TRIPLETS)" in line:
+                entry["block"] = "triplets"
+            else:
+                entry["block"] = "singlets"
+                entry["step"] = entry.get("step", 0) + 1
+        elif "CALCULATED SOCME BETWEEN TRIPLETS AND SINGLETS" in line:
+            # every step has an xyz and an M_S block, get_socme only needs the
+            # number of roots and the blocks from the last xyz block on
+            if entry.get("socme_blocks", 0) % 2 == 0:
+                entry["socme_offset"] = position
+            entry["socme_blocks"] = entry.get("socme_blocks", 0) + 1
+        elif "ORCA TERMINATED NORMALLY" in line and "socme_offset" in entry:
+            finished = True
+        else:
+            match = ORCA_STATE.search(line)
+            if match:
+                nr, au, ev, icm, s2, mult = match.groups()
+                records.append(
+                    {
+                        "state": int(nr),
+                        "energy_au": float(au),
+                        "energy_ev": float(ev),
+                        "energy_icm": float(icm),
+                        "s2": float(s2) if s2 else None,
+                        "multiplicity": int(mult) if mult else None,
+                        "block": entry.get("block"),
+                        "step": entry.get("step"),
+                    }
+                )
+        position += len(raw)
+    with open(outputs(path, "orca")[0], "a") as handle:
+        for record in records:
+            handle.write(json.dumps(record) + "\n")
+    if finished:
+        # the states are written and the offset moves on even if this fails,
+        # so a broken SOCME block is reported once and not on every look
+        try:
+            write_socme(path, entry)
+        except Exception as error:
+            print(f"{path}: no SOCME matrices, {error}")
+    return len(records)
+
+
+def write_socme(path, entry):
+    """the SOCME matrices of a finished ORCA job, like getmat.py saves them"""
+    import getmat
+
+    with open(path, "rb") as handle:
+        handle.seek(entry["socme_offset"])
+        text = handle.read().decode(errors="replace")
+    lines = [entry["roots_line"]] + text.splitlines(keepends=True)
+    with redirect_stdout(io.StringIO()):
+        st_xyz_mat, st_ms_mat = getmat.get_socme(lines)
+    _, ms_name, xyz_name = outputs(path, "orca")
+    getmat.save_mat(st_ms_mat, ms_name)
+    getmat.save_mat(st_xyz_mat, xyz_name)
+
+
+def update(path, kind, entry):
+    """converts the complete records appended to a file, returns how many"""
+    data, start = new_bytes(path, kind, entry)
+    end = complete_end(data, kind)
+    if end == 0:
+        return 0
+    text = data[:end].decode(errors="replace")
+    if kind == "fafoom":
+        count = update_fafoom(path, text, entry)
+    elif kind == "gaussian":
+        count = update_gaussian(path, text, entry)
+    else:
+        count = update_orca(path, data[:end], entry, start)
+    offset = start + end
+    with open(path, "rb") as handle:
+        handle.seek(max(0, offset - CHECK))
+        entry["check"] = handle.read(offset - max(0, offset - CHECK)).hex()
+    entry["offset"] = offset
+    return count
+
+
+def scan(directory):
+    """looks at every file of a job directory once"""
+    state = read_state(directory)
+    changed = False
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        entry = state.get(name)
+        stat = os.stat(path)
+        if entry is not None and (entry.get("size"), entry.get("mtime")) == (
+            stat.st_size,
+            stat.st_mtime,
+        ):
+            continue
+        kind = entry["kind"] if entry else file_kind(path)
+        if kind is None:
+            continue
+        entry = entry or {"kind": kind}
+        try:
+            count = update(path, kind, entry)
+        except Exception as error:
+            print(f"{path}: {error}")
+            continue
+        entry["kind"] = kind
+        entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+        state[name] = entry
+        changed = True
+        if count:
+            print(f"{path}: {count} new {'structures' if kind == 'fafoom' else 'states'}")
+    if changed:
+        write_state(directory, state)
+
+
+def waiter(dirs, interval, use_inotify):
+    """a function that returns after the next change or after interval seconds
+    and one that adds a new directory to the watched ones"""
+    if use_inotify:
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            use_inotify = False
+    if not use_inotify:
+        return lambda: time.sleep(interval), lambda directory: None
+
+    inotify = INotify()
+    mask = flags.MODIFY | flags.CLOSE_WRITE | flags.CREATE | flags.MOVED_TO
+
+    def add(directory):
+        inotify.add_watch(directory, mask)
+
+    def wait():
+        inotify.read(timeout=int(interval * 1000), read_delay=100)
+
+    for directory in dirs:
+        add(directory)
+    return wait, add
+
+
+def main():
+    args = get_input(sys.argv[1:])
+
+    dirs = job_dirs(args.dirs, args.recursive)
+    wait, add = waiter(dirs, args.interval, not args.no_inotify)
+    while True:
+        for directory in dirs:
+            scan(directory)
+        if args.once:
+            break
+        wait()
+        if args.recursive:
+            # new job directories
+            for directory in job_dirs(args.dirs, args.recursive):
+                if directory not in dirs:
+                    add(directory)
+                    dirs.append(directory)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass